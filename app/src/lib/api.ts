@@ -17,7 +17,8 @@ export interface Agent {
 }
 
 export interface Log {
-	timestamp: number;
+	cursor: number;
+	timestamp: number | null;
 	agent_id: string;
 	task_id: string;
 	action_id: string;
@@ -33,11 +34,28 @@ export interface Task {
 	status: string;
 }
 
+// Rows per request when paging through /agents and /tasks
+const PAGE_SIZE = 1000;
+
 export class ApiClient {
 	constructor(private baseUrl: string) {
 		this.baseUrl = baseUrl;
 	}
 
+	// /agents and /tasks return one page after `offset`, oldest first, so keep asking until a short page
+	private async getAllPages<T>(path: string): Promise<T[]> {
+		const rows: T[] = [];
+		while (true) {
+			const page: T[] = await fetch(`${this.baseUrl}${path}?offset=${rows.length}&limit=${PAGE_SIZE}`).then(
+				(res) => res.json()
+			);
+			rows.push(...page);
+			if (page.length < PAGE_SIZE) {
+				return rows;
+			}
+		}
+	}
+
 	async createAgent(agent: Agent): Promise<Agent> {
 		const response = await fetch(`${this.baseUrl}/agents`, {
 			method: 'POST',
@@ -50,7 +68,7 @@ export class ApiClient {
 	}
 
 	async getAgents(): Promise<Agent[]> {
-		return fetch(`${this.baseUrl}/agents`).then((res) => res.json());
+		return this.getAllPages<Agent>('/agents');
 	}
 
 	async getAgent(id: string): Promise<Agent> {
@@ -77,12 +95,12 @@ export class ApiClient {
         return result.text();
 	}
 
-	async getLogs(): Promise<Log[]> {
-		return fetch(`${this.baseUrl}/logs`).then((res) => res.json());
+	async getLogs(since = 0, limit = 1000): Promise<Log[]> {
+		return fetch(`${this.baseUrl}/logs?since=${since}&limit=${limit}`).then((res) => res.json());
 	}
 
 	async getTasks(): Promise<Task[]> {
-		return fetch(`${this.baseUrl}/tasks`).then((res) => res.json());
+		return this.getAllPages<Task>('/tasks');
 	}
 }
 
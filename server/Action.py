@@ -3,26 +3,45 @@ from enum import Enum
 import json
 import uuid
 
+from Product import Product
+
 
 class Action:
-    def __init__(self, action_type, context, target_url):
+    def __init__(self, action_type, context, target_url, product=None):
         self.action_id   = uuid.uuid1()
         self.action_type = action_type
         self.context     = context
         self.target_url  = target_url
+        self.product     = product
         self.step        = None
 
-    def to_json(self):
+    def to_json(self, action_id=None):
         return json.dumps({
-            'action_id': str(self.action_id),
+            'action_id': str(self.action_id if action_id is None else action_id),
             'action_type': str(self.action_type),
             'context': self.context,
         }, indent=4)
 
-    def array_to_json(array):
+    def to_dict(self):
+        return {
+            'action_id': str(self.action_id),
+            'action_type': self.action_type.name,
+            'context': self.context,
+            'target_url': self.target_url,
+            'product': None if self.product is None else self.product.to_dict(),
+        }
+
+    def from_dict(data):
+        product = Product.from_dict(data['product']) if data.get('product') else None
+        action = Action(ActionType[data['action_type']], data['context'], data['target_url'], product)
+        action.action_id = data['action_id']
+        return action
+
+    def array_to_json(array, ids=None):
+        """`ids` replaces the action ids in the output, e.g. with positions that are stable across tasks."""
         options = ""
-        for action in array:
-            options += action.to_json() + "\n"
+        for i, action in enumerate(array):
+            options += action.to_json(None if ids is None else ids[i]) + "\n"
 
         return options
 
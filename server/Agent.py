@@ -1,6 +1,7 @@
 import enum
 from enum import Enum
-import sqlite3
+
+import Storage
 
 
 class Agent:
@@ -10,25 +11,7 @@ class Agent:
         self.user_profile = user_profile
 
     def persist(self):
-        conn = sqlite3.connect("storage.db")
-        c = conn.cursor()
-
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS agents (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                user_profile_id TEXT,
-                FOREIGN KEY (user_profile_id) REFERENCES user_profiles (id)
-            )
-        ''')
-
-        c.execute('''
-            INSERT INTO agents (id, name, user_profile_id)
-            VALUES (?, ?, ?)
-        ''', (
-            str(self.id), self.name, str(self.user_profile.id)
-        ))
-        conn.commit()
+        Storage.get_storage().save_agents([self])
 
 
 class AgentStatus(Enum):
@@ -1,15 +1,20 @@
+import asyncio
 import enum
+import json
 import logging
-import sqlite3
+import time
 import uuid
 
-from langchain import LLMChain
-from langchain.llms import OpenAI
-from langchain.prompts import PromptTemplate
-
 from Action import Action, ActionType
 from Agent import Agent
+import Decision
+from DecisionBackend import get_backend
+import EventBus
+from LogWriter import get_log_writer
+from Prefetcher import get_prefetcher
+from PromptEncoding import get_encoding
 from Scraper import Scraper
+import Storage
 
 logger = logging.getLogger('uvicorn')
 
@@ -30,183 +35,227 @@ class AgentTask:
 
     def persist(self):
         # TODO: not persisting scraper
-        conn = sqlite3.connect("storage.db")
-        c = conn.cursor()
-
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS agent_tasks (
-                id TEXT PRIMARY KEY,
-                agent_id TEXT,
-                initial_goal TEXT,
-                status INTEGER,
-                FOREIGN KEY (agent_id) REFERENCES agents (id)
-            )
-        """)
-
-        c.execute('''
-            INSERT INTO agent_tasks (id, agent_id, initial_goal, status)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            str(self.id), str(self.agent.id), self.initial_goal, self.status.value
-        ))
-        conn.commit()
-
-    def load_history(self):
-        if len(self.actions_history) > 0:
-            return
+        Storage.get_storage().save_tasks([self])
 
-        conn = sqlite3.connect("storage.db")
-        c = conn.cursor()
-
-        c.execute('''
-            SELECT name FROM sqlite_master WHERE type='table' AND name=?
-        ''', ("logs",))
-        if c.fetchone() is None:
+    def load_history(self, max_step=None):
+        if len(self.actions_history) > 0:
             return
 
-        c.execute('''
-            SELECT agent_id, task_id, action_id, action_type, context, target_url, step
-            FROM logs
-            WHERE task_id = ?
-            ORDER BY step
-        ''', (str(self.id),))
-
-        rows = c.fetchall()
         history = []
-
-        for row in rows:
+        for row in Storage.get_storage().load_logs(self.id, max_step):
             agent_id, task_id, action_id, action_type, context, target_url, step = row
             action = Action(action_type, context, target_url)
             action.action_id = action_id
             action.step = step
             history.append(action)
 
-        conn.close()
         self.actions_history = history
 
     def save_history(self):
-        conn = sqlite3.connect("storage.db")
-        c = conn.cursor()
-
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS logs (
-                agent_id TEXT,
-                task_id TEXT,
-                action_id TEXT PRIMARY KEY,
-                action_type TEXT,
-                context TEXT,
-                target_url TEXT,
-                step INTEGER
-            )
-        """)
-
+        log_writer = get_log_writer()
         for step, action in enumerate(self.actions_history, start=1):
-            c.execute('''
-                INSERT INTO logs (agent_id, task_id, action_id, action_type, context, target_url, step)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                str(self.agent.id), str(self.id), str(action.action_id), str(action.action_type), str(action.context), str(action.target_url), step
-            ))
-            conn.commit()
-            # TODO: This is really ugly and should be somewhere else, but I'm too lazy
             action.step = step
-        conn.close()
+            log_writer.submit(self, action)
+        log_writer.flush()
 
     def execute(self):
-        self.status = TaskStatus.IN_PROGRESS
-
-        if len(self.actions_history) == 0:
-            self.next_possible_actions = self.scraper.get_initial_actions(self.initial_goal)
+        self.start()
 
         while True:
             next_action = self.choose_from_next_actions()
             #logger.info(f"Agent: {self.agent.id} Task: {self.id} Action: {str(next_action)}")
 
-            if next_action is not None:
-                #print(next_action.to_json())
-                self.actions_history.append(next_action)
+            if not self.take_action(next_action):
+                break
+            self.next_possible_actions = self.scraper.scrape_page_into_possible_actions(next_action.target_url)
+            #print(Action.array_to_json(self.next_possible_actions))
+            self.checkpoint()
+
+        self.finish()
+
+    async def execute_async(self):
+        """Same as execute, but awaits page fetches and the LLM.
+
+        Database access and HTML parsing run in the default executor, so a
+        task never holds up the other tasks on the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.start)
+
+        while True:
+            next_action = await self.choose_from_next_actions_async()
 
-            if next_action is not None and next_action.action_type is not ActionType.BUY_NOW:
-                self.next_possible_actions = self.scraper.scrape_page_into_possible_actions(next_action.target_url)
-                #print(Action.array_to_json(self.next_possible_actions))
-            else:
+            if not self.take_action(next_action):
                 break
+            self.next_possible_actions = await self.scraper.scrape_page_into_possible_actions_async(next_action.target_url)
+            self.checkpoint()
+
+        await loop.run_in_executor(None, self.finish)
+
+    def start(self):
+        self.status = TaskStatus.IN_PROGRESS
+        self.persist_status_update()
+
+        if len(self.next_possible_actions) == 0 and not self.restore_checkpoint():
+            # Nothing to continue from, so start over
+            if len(self.actions_history) > 0:
+                Storage.get_storage().delete_logs(self.id)
+                self.actions_history = []
+            self.next_possible_actions = self.scraper.get_initial_actions(self.initial_goal)
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Persists everything needed to continue after the last recorded step."""
+        get_log_writer().submit_checkpoint(self)
+
+    def restore_checkpoint(self):
+        # Rows of an earlier attempt in this process may still be buffered
+        get_log_writer().flush()
+        checkpoint = Storage.get_storage().load_checkpoint(self.id)
+        if checkpoint is None:
+            return False
+
+        step, next_actions, scraper_state = checkpoint
+        storage = Storage.get_storage()
+        # Steps logged after the checkpoint are redone, so drop them
+        storage.delete_logs(self.id, after_step=step)
+        self.actions_history = []
+        self.load_history(max_step=step)
+        self.next_possible_actions = [Action.from_dict(data) for data in json.loads(next_actions)]
+        self.scraper.set_state(json.loads(scraper_state))
+        logger.info(f'Task {self.id} resumed after step {step}')
+        return True
+
+    def take_action(self, next_action):
+        """Records the chosen action and returns whether the task should continue browsing."""
+        if next_action is not None:
+            #print(next_action.to_json())
+            self.record_action(next_action)
+
+        return next_action is not None and next_action.action_type is not ActionType.BUY_NOW
+
+    def finish(self):
         logger.info(f'Task {self.id} finished')
 
-        self.save_history()
+        get_log_writer().flush()
         self.status = TaskStatus.FINISHED
         self.persist_status_update()
+        Storage.get_storage().delete_checkpoint(self.id)
+
+    def record_action(self, action):
+        self.actions_history.append(action)
+        action.step = len(self.actions_history)
+        get_log_writer().submit(self, action)
+        EventBus.get_event_bus().publish(EventBus.ACTION, {
+            "timestamp": int(round(time.time())),
+            "agent_id": str(self.agent.id),
+            "task_id": str(self.id),
+            "action_id": str(action.action_id),
+            "action_type": str(action.action_type),
+            "goal": self.initial_goal,
+            "url": str(action.target_url),
+            "step": action.step,
+        })
 
     def persist_status_update(self):
-        conn = sqlite3.connect("storage.db")
-        c = conn.cursor()
-
-        c.execute('''
-            UPDATE agent_tasks
-            SET status = ?
-            WHERE id = ?
-        ''', (self.status.value, str(self.id)))
-
-        conn.commit()
-        conn.close()
+        Storage.get_storage().update_task_status(self.id, self.status)
+        EventBus.get_event_bus().publish(EventBus.STATUS, {
+            "agent_id": str(self.agent.id),
+            "task_id": str(self.id),
+            "goal": self.initial_goal,
+            "status": self.status.name,
+        })
 
     def choose_from_next_actions(self):
+        action = self.choose_without_llm()
+        if action is not None:
+            return action
+
+        key = self.decision_cache_key()
+        action = self.cached_decision(key)
+        if action is not None:
+            return action
+
+        return self.remember_decision(key, get_backend().decide(self))
+
+    async def choose_from_next_actions_async(self):
+        action = self.choose_without_llm()
+        if action is not None:
+            return action
+
+        key = self.decision_cache_key()
+        action = self.cached_decision(key)
+        if action is not None:
+            return action
+
+        # Fetch the candidate pages while the decision is being made
+        prefetcher = get_prefetcher()
+        prefetch = prefetcher.prefetch(self.scraper, self.next_possible_actions) if prefetcher else None
+        try:
+            action = await get_backend().decide_async(self)
+        except BaseException:
+            if prefetch is not None:
+                prefetch.cancel()
+            raise
+        if prefetch is not None:
+            await prefetch.settle(action.target_url if action is not None else None)
+        return self.remember_decision(key, action)
+
+    def choose_without_llm(self):
         if len(self.next_possible_actions) == 1:
             return self.next_possible_actions[0]
 
         if len(self.next_possible_actions) == 0:
             raise Exception("No next actions available. Did scraping fail?")
 
-        base_prompt = """
-        Act as a consumer on an ecommerce webpage with this goal: {goal}
-        You are currently browsing the webpage and are presented with these options:
-        {options}
+        # Out of steps: buying is the only answer the prompt allows
+        if len(self.actions_history) >= Decision.MAX_STEPS:
+            for action in self.next_possible_actions:
+                if action.action_type is ActionType.BUY_NOW:
+                    return action
 
-        You have taken {prev_action_count} previous actions so far:
-        {previous_actions}
-
-        You want to choose the best option to buy (with a BUY_NOW action) after a maximum of {steps} steps.
-        Before taking a BUY_NOW action you should have at least taken {prev_steps} actions.
-        Make sure to look at multiple options before making a BUY_NOW decision so that you make the best, informed decision.
+        return None
 
-        The actions should be taken from the point of view of a user with the following profile:
-        - Gender: {gender}
-        - Age Range: {age_from} - {age_to}
-        - Location: {location}
-        - Interests: {interests}
+    def decision_cache_key(self):
+        if not Decision.decision_cache.enabled:
+            return None
+        return Decision.decision_cache.key(self.build_prompt_inputs(stable_ids=True))
 
-        Please think carefully how users with different profiles interact with the platform when making e-commerce purchases.
-        To re-iterate: Take between {prev_steps} and {steps} actions.
-        Tell me which option you are taking by responding with the corresponding action ID. You should only reply with ONE action id, no other characters or words.
-        """
-        prompt = PromptTemplate.from_template(base_prompt)
-        chain  = LLMChain(llm=OpenAI(max_tokens=-1, temperature=0.3), prompt=prompt, verbose=1)
-
-        options          = Action.array_to_json(self.next_possible_actions)
-        previous_actions = Action.array_to_json(self.actions_history)
-
-        result = chain.run(
-                {"goal": self.initial_goal,
-                 "options": options,
-                 "steps": "10",
-                 "prev_steps": "4",
-                 "prev_action_count": str(len(self.actions_history)),
-                 "previous_actions": previous_actions,
-                 "gender": self.agent.user_profile.gender,
-                 "age_from": self.agent.user_profile.age_from,
-                 "age_to": self.agent.user_profile.age_to,
-                 "location": self.agent.user_profile.location,
-                 "interests": ", ".join(self.agent.user_profile.interests)})
-
-        return self.find_next_action_by_id(result)
+    def cached_decision(self, key):
+        if key is None:
+            return None
+        index = Decision.decision_cache.get(key)
+        if index is None or index >= len(self.next_possible_actions):
+            return None
+        return self.next_possible_actions[index]
+
+    def remember_decision(self, key, action):
+        if key is not None and action is not None:
+            Decision.decision_cache.put(key, self.next_possible_actions.index(action))
+        return action
+
+    def build_prompt_inputs(self, stable_ids=False):
+        options, previous_actions = get_encoding().encode(self.next_possible_actions, self.actions_history, stable_ids)
+
+        return {"goal": self.initial_goal,
+                "options": options,
+                "steps": str(Decision.MAX_STEPS),
+                "prev_steps": str(Decision.MIN_STEPS),
+                "prev_action_count": str(len(self.actions_history)),
+                "previous_actions": previous_actions,
+                "gender": self.agent.user_profile.gender,
+                "age_from": self.agent.user_profile.age_from,
+                "age_to": self.agent.user_profile.age_to,
+                "location": self.agent.user_profile.location,
+                "interests": ", ".join(self.agent.user_profile.interests)}
 
     def find_next_action_by_id(self, action_id):
         if len(self.next_possible_actions) == 0:
             return None
 
-        for action in self.next_possible_actions:
-            if str(action.action_id).strip() == str(action_id).strip():
-                return action
+        action = get_encoding().resolve(self.next_possible_actions, action_id)
+        if action is not None:
+            return action
 
         print("Something went wrong with getting the response from the LLM. The response was: " + action_id)
         return None
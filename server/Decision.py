@@ -0,0 +1,143 @@
+import hashlib
+import os
+import threading
+import time
+
+from langchain import LLMChain
+from langchain.llms import OpenAI
+from langchain.prompts import PromptTemplate
+
+from LRUCache import LRUCache
+
+BASE_PROMPT = """
+        Act as a consumer on an ecommerce webpage with this goal: {goal}
+        You are currently browsing the webpage and are presented with these options:
+        {options}
+
+        You have taken {prev_action_count} previous actions so far:
+        {previous_actions}
+
+        You want to choose the best option to buy (with a BUY_NOW action) after a maximum of {steps} steps.
+        Before taking a BUY_NOW action you should have at least taken {prev_steps} actions.
+        Make sure to look at multiple options before making a BUY_NOW decision so that you make the best, informed decision.
+
+        The actions should be taken from the point of view of a user with the following profile:
+        - Gender: {gender}
+        - Age Range: {age_from} - {age_to}
+        - Location: {location}
+        - Interests: {interests}
+
+        Please think carefully how users with different profiles interact with the platform when making e-commerce purchases.
+        To re-iterate: Take between {prev_steps} and {steps} actions.
+        Tell me which option you are taking by responding with the corresponding action ID. You should only reply with ONE action id, no other characters or words.
+        """
+
+MAX_STEPS = 10
+MIN_STEPS = 4
+
+# "off", "on" (entries expire after DECISION_CACHE_TTL seconds) or "replay" (entries never expire)
+DECISION_CACHE_MODE = os.environ.get("DECISION_CACHE", "off")
+DECISION_CACHE_TTL  = float(os.environ.get("DECISION_CACHE_TTL", "3600"))
+DECISION_CACHE_SIZE = int(os.environ.get("DECISION_CACHE_SIZE", "10000"))
+
+_lock   = threading.Lock()
+_prompt = None
+_chain  = None
+
+
+def get_prompt_template():
+    global _prompt
+    if _prompt is None:
+        with _lock:
+            if _prompt is None:
+                _prompt = PromptTemplate.from_template(BASE_PROMPT)
+    return _prompt
+
+
+def get_chain():
+    """The LLM chain shared by all tasks; building the OpenAI client once avoids per-step setup."""
+    global _chain
+    if _chain is None:
+        prompt = get_prompt_template()
+        with _lock:
+            if _chain is None:
+                _chain = LLMChain(llm=OpenAI(max_tokens=-1, temperature=0.3), prompt=prompt, verbose=1)
+    return _chain
+
+
+class DecisionCache:
+    """Remembers which option was chosen for a rendered prompt.
+
+    Keys are hashes of the prompt rendered with positional option ids, so the
+    same situation maps to the same key across tasks. Values are the index of
+    the chosen option. In replay mode entries never expire, making repeated
+    runs of the same agent and goal deterministic.
+    """
+
+    def __init__(self, mode=DECISION_CACHE_MODE, ttl=DECISION_CACHE_TTL, max_entries=DECISION_CACHE_SIZE):
+        self.mode    = mode
+        self.ttl     = None if mode == "replay" else ttl
+        self.entries = LRUCache(max_entries=max_entries)
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def key(self, inputs):
+        return hashlib.sha256(get_prompt_template().format(**inputs).encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        index, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            self.entries.pop(key)
+            return None
+        return index
+
+    def put(self, key, index):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self.entries.put(key, (index, expires_at))
+
+
+decision_cache = DecisionCache()
+
+
+BATCH_PROMPT = """
+        Act as several different consumers browsing an ecommerce webpage. Each request below describes one consumer:
+        their goal, their profile, the actions they have taken so far and the options they are presented with now.
+
+        For every request, choose the option that consumer takes next.
+        Each consumer wants to choose the best option to buy (with a BUY_NOW action) after a maximum of {steps} steps.
+        Before taking a BUY_NOW action a consumer should have at least taken {prev_steps} actions.
+        Make sure consumers look at multiple options before making a BUY_NOW decision so that they make the best, informed decision.
+        Please think carefully how users with different profiles interact with the platform when making e-commerce purchases.
+
+        {requests}
+
+        Reply with a JSON object that maps every request label to the ONE action id chosen for it,
+        for example {{"R1": "<action id>", "R2": "<action id>"}}. Do not reply with any other characters or words.
+        """
+
+REQUEST_TEMPLATE = """
+        Request {label}:
+        Goal: {goal}
+        Profile: Gender: {gender}; Age Range: {age_from} - {age_to}; Location: {location}; Interests: {interests}
+        Previous actions ({prev_action_count}):
+        {previous_actions}
+        Options:
+        {options}
+        """
+
+_batch_chain = None
+
+
+def get_batch_chain():
+    global _batch_chain
+    if _batch_chain is None:
+        llm = get_chain().llm
+        with _lock:
+            if _batch_chain is None:
+                _batch_chain = LLMChain(llm=llm, prompt=PromptTemplate.from_template(BATCH_PROMPT), verbose=1)
+    return _batch_chain
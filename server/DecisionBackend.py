@@ -0,0 +1,118 @@
+import os
+import random
+import threading
+
+import Decision
+import Storage
+from Action import ActionType
+from DecisionBatcher import get_batcher
+
+# "openai", "random" (seeded local policy, no network) or "replay" (decisions recorded in storage.db)
+DECISION_BACKEND = os.environ.get("DECISION_BACKEND", "openai")
+DECISION_SEED    = os.environ.get("DECISION_SEED", "0")
+
+
+class DecisionBackend:
+    """Chooses a task's next action from its next_possible_actions."""
+    name = None
+
+    def decide(self, task):
+        raise NotImplementedError
+
+    async def decide_async(self, task):
+        return self.decide(task)
+
+
+class OpenAIBackend(DecisionBackend):
+    name = "openai"
+
+    def decide(self, task):
+        return task.find_next_action_by_id(Decision.get_chain().run(task.build_prompt_inputs()))
+
+    async def decide_async(self, task):
+        batcher = get_batcher()
+        if batcher is not None:
+            result = await batcher.decide(task.build_prompt_inputs())
+        else:
+            result = await Decision.get_chain().arun(task.build_prompt_inputs())
+        return task.find_next_action_by_id(result)
+
+
+class RandomPolicyBackend(DecisionBackend):
+    """Picks options at random while keeping to the step bounds of the prompt.
+
+    It never buys before MIN_STEPS actions and becomes more likely to buy with
+    every step after that. The choice only depends on the seed, the task and
+    the step, so a task browses the same way whenever it is run (or resumed),
+    while repeated tasks of the same agent and goal take different paths.
+    """
+    name = "random"
+
+    def __init__(self, seed=DECISION_SEED):
+        self.seed = seed
+
+    def decide(self, task):
+        step = len(task.actions_history)
+        rng = random.Random(f"{self.seed}:{task.id}:{step}")
+
+        buy = [action for action in task.next_possible_actions if action.action_type is ActionType.BUY_NOW]
+        browse = [action for action in task.next_possible_actions if action.action_type is not ActionType.BUY_NOW]
+
+        if buy and (not browse or step >= Decision.MIN_STEPS and
+                    rng.random() < (step - Decision.MIN_STEPS + 1) / (Decision.MAX_STEPS - Decision.MIN_STEPS + 1)):
+            return buy[0]
+        return rng.choice(browse)
+
+
+class ReplayBackend(DecisionBackend):
+    """Repeats the decisions an agent made for the same goal in earlier runs.
+
+    At every step the option matching the action logged for that step (same
+    type and context) is chosen. Steps with no matching recording are
+    decided by `fallback`.
+    """
+    name = "replay"
+
+    def __init__(self, storage=None, fallback=None):
+        self.storage  = storage
+        self.fallback = fallback or RandomPolicyBackend()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def decide(self, task):
+        step = len(task.actions_history) + 1
+        for recorded in self.sessions(task.agent.id, task.initial_goal):
+            if step not in recorded:
+                continue
+            for action in task.next_possible_actions:
+                if (str(action.action_type), action.context) == recorded[step]:
+                    return action
+        return self.fallback.decide(task)
+
+    def sessions(self, agent_id, initial_goal):
+        key = (str(agent_id), initial_goal)
+        with self._lock:
+            sessions = self._sessions.get(key)
+        if sessions is not None:
+            return sessions
+
+        by_task = {}
+        storage = self.storage or Storage.get_storage()
+        for task_id, step, action_type, context in storage.load_recorded_actions(agent_id, initial_goal):
+            by_task.setdefault(task_id, {})[step] = (action_type, context)
+        sessions = list(by_task.values())
+        with self._lock:
+            self._sessions[key] = sessions
+        return sessions
+
+
+BACKENDS = {backend.name: backend for backend in (OpenAIBackend, RandomPolicyBackend, ReplayBackend)}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[DECISION_BACKEND]()
+    return _backend
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import os
+
+import Decision
+
+logger = logging.getLogger('uvicorn')
+
+# Batching is off unless a window is configured
+DECISION_BATCH_WINDOW_MS = float(os.environ.get("DECISION_BATCH_WINDOW_MS", "0"))
+DECISION_BATCH_SIZE      = int(os.environ.get("DECISION_BATCH_SIZE", "10"))
+DECISION_BATCH_PARALLEL  = int(os.environ.get("DECISION_BATCH_PARALLEL", "4"))
+
+
+class DecisionBatcher:
+    """Collects decisions from concurrently running tasks and asks the LLM for several at once.
+
+    Decisions arriving within `window` seconds of each other are sent as one
+    request of at most `max_batch` entries; at most `max_parallel` requests are
+    in flight. Each task gets back the action id chosen for it. Entries the
+    model did not answer are retried on their own with the regular prompt.
+    """
+
+    def __init__(self, window, max_batch=DECISION_BATCH_SIZE, max_parallel=DECISION_BATCH_PARALLEL):
+        self.window    = window
+        self.max_batch = max_batch
+        self._pending  = []
+        self._timer    = None
+        self._slots    = asyncio.Semaphore(max_parallel)
+
+    async def decide(self, inputs):
+        """Takes the inputs of the regular prompt and returns the LLM's answer (an action id)."""
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((inputs, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        for i in range(0, len(pending), self.max_batch):
+            asyncio.ensure_future(self._run_batch(pending[i:i + self.max_batch]))
+
+    async def _run_batch(self, batch):
+        async with self._slots:
+            try:
+                if len(batch) == 1:
+                    answers = {}
+                else:
+                    answers = await self._ask(batch)
+
+                unanswered = []
+                for label, (inputs, future) in self._labelled(batch):
+                    if label in answers:
+                        self._resolve(future, answers[label])
+                    else:
+                        unanswered.append((inputs, future))
+
+                results = await asyncio.gather(*[Decision.get_chain().arun(inputs) for inputs, _ in unanswered],
+                                               return_exceptions=True)
+                for (_, future), result in zip(unanswered, results):
+                    self._resolve(future, result)
+            except Exception as e:
+                for _, future in batch:
+                    self._resolve(future, e)
+
+    def _labelled(self, batch):
+        return [(f"R{i}", entry) for i, entry in enumerate(batch, start=1)]
+
+    async def _ask(self, batch):
+        requests = "".join(Decision.REQUEST_TEMPLATE.format(label=label, **inputs)
+                           for label, (inputs, _) in self._labelled(batch))
+        first = batch[0][0]
+        result = await Decision.get_batch_chain().arun({"requests": requests,
+                                                        "steps": first["steps"],
+                                                        "prev_steps": first["prev_steps"]})
+        try:
+            answers = json.loads(result[result.index("{"):result.rindex("}") + 1])
+        except ValueError:
+            logger.warning(f"Could not parse batched LLM decision, asking individually. The response was: {result}")
+            return {}
+        return {str(label): str(action_id) for label, action_id in answers.items()}
+
+    def _resolve(self, future, result):
+        if future.done():
+            return
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+_batchers = {}
+
+
+def get_batcher():
+    """Returns the batcher of the running event loop, or None when batching is disabled."""
+    if DECISION_BATCH_WINDOW_MS <= 0:
+        return None
+    loop = asyncio.get_event_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = DecisionBatcher(DECISION_BATCH_WINDOW_MS / 1000)
+        _batchers[loop] = batcher
+    return batcher
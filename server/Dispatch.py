@@ -0,0 +1,33 @@
+import Repository
+import Storage
+from AgentTask import AgentTask
+from Scraper import create_scraper
+
+# Upper bound on the tasks a single dispatch request may create
+MAX_DISPATCH_TASKS = 100000
+
+
+def schedule(agents, goals, repetitions=1):
+    """(agent, goal) pairs ordered goal by goal.
+
+    Tasks for the same goal start with the same search page and often reach
+    the same product pages, so running them next to each other lets them
+    share fetches and keeps those pages in the cache while they are needed.
+    Within a goal the agents take turns, so every agent makes progress early.
+    """
+    return [(agent, goal) for goal in goals for _ in range(repetitions) for agent in agents]
+
+
+def dispatch(agents, goals, repetitions, queue, new_agents=()):
+    """Creates a task for every agent × goal × repetition and queues them in schedule order.
+
+    `new_agents` are saved first; agents, tasks and queue entries are all
+    written in one transaction. Returns the tasks.
+    """
+    tasks = [AgentTask(agent, create_scraper(), goal) for agent, goal in schedule(agents, goals, repetitions)]
+    with Storage.get_storage().transaction() as conn:
+        if new_agents:
+            Repository.get_agent_repository().add_all(new_agents, conn)
+        Repository.get_task_repository().add_all(tasks, conn)
+        queue.enqueue([task.id for task in tasks], conn)
+    return tasks
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import threading
+
+import Fetcher
+
+logger = logging.getLogger('uvicorn')
+
+DEFAULT_MAX_CONCURRENT_TASKS = int(os.environ.get("MAX_CONCURRENT_TASKS", "100"))
+
+
+class TaskEngine:
+    """Runs AgentTasks on an asyncio event loop in a dedicated thread.
+
+    Page fetches and LLM calls are awaited instead of blocking a thread, so a
+    single process can drive hundreds of tasks without using up the API's
+    threadpool. At most `max_concurrency` tasks execute at once; the rest wait
+    for a free slot.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENT_TASKS):
+        self.max_concurrency = max_concurrency
+        self.loop            = asyncio.new_event_loop()
+        self._semaphore      = None
+        self._started        = threading.Event()
+        self._thread         = threading.Thread(target=self._run_loop, name="task-engine", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._started.set()
+        self.loop.run_forever()
+
+    def submit(self, task):
+        """Schedules `task` and returns a concurrent.futures.Future for its completion."""
+        return asyncio.run_coroutine_threadsafe(self._execute(task), self.loop)
+
+    async def _execute(self, task):
+        async with self._semaphore:
+            try:
+                await task.execute_async()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Task {task.id} failed")
+                raise
+
+    def stop(self, timeout=None):
+        if not self.loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+    async def _shutdown(self):
+        current = asyncio.current_task()
+        pending = [t for t in asyncio.all_tasks() if t is not current]
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await Fetcher.get_fetcher().close_session()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = TaskEngine()
+    return _engine
+
+
+def stop_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.stop()
+            _engine = None
+
+
+def configure(max_concurrency):
+    """Replace the process-wide engine with one of another size (e.g. for benchmarks)."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.stop()
+        _engine = TaskEngine(max_concurrency)
+    return _engine
@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import os
+import threading
+
+# Events kept for clients that reconnect with a cursor, and events buffered per subscriber before it is cut off
+EVENT_HISTORY_SIZE = int(os.environ.get("EVENT_HISTORY_SIZE", "10000"))
+EVENT_BUFFER_SIZE  = int(os.environ.get("EVENT_BUFFER_SIZE", "1000"))
+
+ACTION = "action"
+STATUS = "status"
+LAGGED = "lagged"
+RESET  = "reset"
+
+Event = collections.namedtuple("Event", ["cursor", "type", "data"])
+
+
+def event_filter(agent_id=None, task_id=None, types=None):
+    """Returns a predicate matching events of the given agent, task and event types (any if None)."""
+    def matches(event):
+        return (types is None or event.type in types) and \
+               (agent_id is None or event.data.get("agent_id") == agent_id) and \
+               (task_id is None or event.data.get("task_id") == task_id)
+    return matches
+
+
+class Subscription:
+    """Events for one client, delivered from any thread to the event loop the client is served on.
+
+    Publishers never wait for a subscriber. A subscriber that falls more than
+    `buffer_size` events behind is cut off with a LAGGED event carrying the
+    last cursor it received, so it can reconnect and replay from there.
+    """
+
+    def __init__(self, bus, matches, buffer_size):
+        self.bus         = bus
+        self.matches     = matches
+        self.buffer_size = buffer_size
+        self.loop        = asyncio.get_event_loop()
+        self.lagged      = False
+        self.cursor      = 0
+        self._buffer     = collections.deque()
+        self._ready      = asyncio.Event()
+        self._waiting    = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.bus.unsubscribe(self)
+
+    def deliver(self, event):
+        # Called by the bus with its lock held
+        if self.lagged or not self.matches(event):
+            return
+        if len(self._buffer) >= self.buffer_size:
+            self.lagged = True
+        else:
+            self._buffer.append(event)
+        if self._waiting:
+            self._waiting = False
+            try:
+                self.loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                # The client's event loop is gone
+                self.lagged = True
+
+    async def stream(self, heartbeat=None):
+        """Yields events as they are published, and None after `heartbeat` seconds without any."""
+        while True:
+            with self.bus.lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+                lagged = self.lagged and not events
+                if not events and not lagged:
+                    self._ready.clear()
+                    self._waiting = True
+
+            if lagged:
+                yield Event(self.cursor, LAGGED, {"cursor": self.cursor})
+                return
+            if events:
+                for event in events:
+                    self.cursor = event.cursor
+                    yield event
+                continue
+
+            try:
+                await asyncio.wait_for(self._ready.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class EventBus:
+    """In-process publish/subscribe for action and task status events.
+
+    Every event gets a cursor that grows by one. The last `history_size`
+    events are kept so subscribers can resume after the cursor they last saw.
+    When events after that cursor are no longer kept (or the cursor is from
+    before a restart), the replay starts with a RESET event instead, so the
+    client knows to re-sync from /logs.
+    """
+
+    def __init__(self, history_size=EVENT_HISTORY_SIZE, buffer_size=EVENT_BUFFER_SIZE):
+        self.buffer_size  = buffer_size
+        self.lock         = threading.Lock()
+        self._history     = collections.deque(maxlen=history_size)
+        self._cursor      = 0
+        self._subscribers = set()
+
+    def publish(self, event_type, data):
+        with self.lock:
+            self._cursor += 1
+            event = Event(self._cursor, event_type, data)
+            self._history.append(event)
+            for subscription in self._subscribers:
+                subscription.deliver(event)
+        return event
+
+    def subscribe(self, after=None, matches=None, buffer_size=None):
+        """Subscribes on the running event loop, first replaying retained events after the cursor `after`."""
+        subscription = Subscription(self, matches or event_filter(), buffer_size or self.buffer_size)
+        with self.lock:
+            subscription.cursor = self._cursor
+            if after is not None:
+                oldest = self._history[0].cursor if self._history else self._cursor + 1
+                # A cursor from before a restart of the server, or events after it that are no longer kept
+                if after > self._cursor or after < oldest - 1:
+                    after = oldest - 1
+                    subscription._buffer.append(Event(after, RESET, {"cursor": after}))
+                subscription.cursor = after
+                subscription._buffer.extend(event for event in self._history
+                                            if event.cursor > after and subscription.matches(event))
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self._subscribers.discard(subscription)
+
+
+_event_bus = None
+_event_bus_lock = threading.Lock()
+
+
+def get_event_bus():
+    global _event_bus
+    if _event_bus is None:
+        with _event_bus_lock:
+            if _event_bus is None:
+                _event_bus = EventBus()
+    return _event_bus
@@ -0,0 +1,231 @@
+"""Streams the synthetic dataset out of storage.db, one browsing session (task) at a time.
+
+    python -m Export --format parquet --out sessions.parquet
+
+NDJSON has one session per line with its ordered actions and the product
+each action refers to; CSV, Parquet and Arrow have one row per action with
+the session's and the product's columns alongside. Every
+session carries a cursor; passing the last cursor received as `after`
+resumes an interrupted export.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+import Storage
+from AgentTask import TaskStatus
+
+DEFAULT_CHUNK_SIZE = 500
+MAX_CHUNK_SIZE     = 900
+CSV_FLUSH_BYTES    = 64 * 1024
+
+PRODUCT_FIELDS = ["asin", "title", "price", "list_price", "rating", "review_count", "bestseller"]
+
+ACTION_COLUMNS = ["cursor", "session_id", "agent_id", "agent_name", "gender", "age_from", "age_to", "location",
+                  "interests", "description", "goal", "status", "step", "action_type", "context", "url", "timestamp"] + \
+                 ["product_" + field for field in PRODUCT_FIELDS]
+
+
+def iter_sessions(after=0, status=None, chunk_size=DEFAULT_CHUNK_SIZE, storage=None):
+    """Yields sessions as dicts, reading `chunk_size` sessions and their actions at a time."""
+    storage = storage or Storage.get_storage()
+    status_value = None if status is None else TaskStatus[status].value
+    while True:
+        rows = storage.load_sessions(after, chunk_size, status_value)
+        if not rows:
+            return
+
+        actions = {}
+        for task_id, step, action_type, context, url, timestamp, *product in \
+                storage.load_session_actions([row[1] for row in rows]):
+            actions.setdefault(task_id, []).append({
+                "step": step,
+                "action_type": str(action_type).split(".")[-1],
+                "context": context,
+                "url": url,
+                "timestamp": timestamp,
+                "product": _product(*product),
+            })
+
+        for cursor, task_id, goal, task_status, agent_id, agent_name, gender, age_from, age_to, location, \
+                interests, description in rows:
+            yield {
+                "cursor": cursor,
+                "session_id": task_id,
+                "agent": {
+                    "id": agent_id,
+                    "name": agent_name,
+                    "gender": gender,
+                    "age_from": age_from,
+                    "age_to": age_to,
+                    "location": location,
+                    "interests": interests.split(', ') if interests else [],
+                    "description": description,
+                },
+                "goal": goal,
+                "status": None if task_status is None else TaskStatus(task_status).name,
+                "actions": actions.get(task_id, []),
+            }
+        after = rows[-1][0]
+
+
+def _product(asin, title, price, list_price, rating, review_count, bestseller):
+    if asin is None:
+        return None
+    return {"asin": asin, "title": title, "price": price, "list_price": list_price, "rating": rating,
+            "review_count": review_count, "bestseller": None if bestseller is None else bool(bestseller)}
+
+
+def action_rows(session):
+    agent = session["agent"]
+    for action in session["actions"]:
+        product = action["product"] or {}
+        yield {
+            "cursor": session["cursor"],
+            "session_id": session["session_id"],
+            "agent_id": agent["id"],
+            "agent_name": agent["name"],
+            "gender": agent["gender"],
+            "age_from": agent["age_from"],
+            "age_to": agent["age_to"],
+            "location": agent["location"],
+            "interests": ", ".join(agent["interests"]),
+            "description": agent["description"],
+            "goal": session["goal"],
+            "status": session["status"],
+            "step": action["step"],
+            "action_type": action["action_type"],
+            "context": action["context"],
+            "url": action["url"],
+            "timestamp": action["timestamp"],
+            **{"product_" + field: product.get(field) for field in PRODUCT_FIELDS},
+        }
+
+
+def export_ndjson(sessions):
+    for session in sessions:
+        yield (json.dumps(session) + "\n").encode()
+
+
+def export_csv(sessions):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ACTION_COLUMNS)
+    writer.writeheader()
+    for session in sessions:
+        writer.writerows(action_rows(session))
+        if buffer.tell() >= CSV_FLUSH_BYTES:
+            yield _drain(buffer).encode()
+    yield _drain(buffer).encode()
+
+
+def _arrow_batches(sessions, chunk_size):
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ("cursor", pa.int64()), ("session_id", pa.string()), ("agent_id", pa.string()), ("agent_name", pa.string()),
+        ("gender", pa.string()), ("age_from", pa.int64()), ("age_to", pa.int64()), ("location", pa.string()),
+        ("interests", pa.string()), ("description", pa.string()), ("goal", pa.string()), ("status", pa.string()),
+        ("step", pa.int64()), ("action_type", pa.string()), ("context", pa.string()), ("url", pa.string()),
+        ("timestamp", pa.float64()), ("product_asin", pa.string()), ("product_title", pa.string()),
+        ("product_price", pa.float64()), ("product_list_price", pa.float64()), ("product_rating", pa.float64()),
+        ("product_review_count", pa.int64()), ("product_bestseller", pa.bool_()),
+    ])
+
+    def batches():
+        rows = []
+        for session in sessions:
+            rows.extend(action_rows(session))
+            if len(rows) >= chunk_size:
+                yield pa.RecordBatch.from_pylist(rows, schema=schema)
+                rows = []
+        if rows:
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+    return schema, batches()
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def export_parquet(sessions, chunk_size=DEFAULT_CHUNK_SIZE * 20):
+    """Writes one row group per `chunk_size` actions and yields the bytes as they are written."""
+    import pyarrow.parquet as pq
+
+    schema, batches = _arrow_batches(sessions, chunk_size)
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for batch in batches:
+        writer.write_batch(batch)
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+def export_arrow(sessions, chunk_size=DEFAULT_CHUNK_SIZE * 20):
+    """Arrow IPC stream format, one record batch per `chunk_size` actions."""
+    import pyarrow as pa
+
+    schema, batches = _arrow_batches(sessions, chunk_size)
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+# format: (writer, media type, file extension, needs pyarrow)
+FORMATS = {
+    "ndjson":  (export_ndjson, "application/x-ndjson", "ndjson", False),
+    "csv":     (export_csv, "text/csv", "csv", False),
+    "parquet": (export_parquet, "application/vnd.apache.parquet", "parquet", True),
+    "arrow":   (export_arrow, "application/vnd.apache.arrow.stream", "arrow", True),
+}
+
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def export(format, after=0, status=None, chunk_size=DEFAULT_CHUNK_SIZE, storage=None):
+    """Yields the export as chunks of bytes."""
+    writer = FORMATS[format][0]
+    return writer(iter_sessions(after, status, chunk_size, storage))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="ndjson")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    parser.add_argument("--after", type=int, default=0, help="cursor of the last session already exported")
+    parser.add_argument("--status", choices=[status.name for status in TaskStatus], help="only sessions with this status")
+    parser.add_argument("--db", default=Storage.DEFAULT_DB_PATH)
+    args = parser.parse_args()
+
+    if FORMATS[args.format][3] and not pyarrow_available():
+        raise SystemExit(f"Exporting {args.format} needs pyarrow: pip install pyarrow")
+
+    storage = Storage.Storage(args.db)
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        for chunk in export(args.format, args.after, args.status, storage=storage):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
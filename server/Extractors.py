@@ -0,0 +1,354 @@
+from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
+from lxml import etree
+
+from Action import Action
+from Action import ActionType
+from Product import Product
+
+
+class AmazonExtractor:
+    """Turns a ParsedPage into Actions. Subclasses differ in the HTML tree they work on."""
+    name = None
+
+    def parse(self, content):
+        raise NotImplementedError
+
+    def extract_products_from_search_page(self, parsed_page):
+        raise NotImplementedError
+
+    def extract_recommendations_from_product_details(self, parsed_page):
+        raise NotImplementedError
+
+    def extract_checkout_from_product_details(self, parsed_page):
+        raise NotImplementedError
+
+    def add_to_str(self, str, key, item):
+        if item is not None:
+            if str is None:
+                str = key + ": " + item
+
+            str += "; " + key + ": " + item
+
+        return str
+
+
+class SoupExtractor(AmazonExtractor):
+    name = "bs4"
+
+    def parse(self, content):
+        return BeautifulSoup(content, "lxml")
+
+    def extract_products_from_search_page(self, parsed_page):
+        LIMIT = 5
+        products = []
+        soup     = parsed_page.document
+
+        search_results = soup.find_all(attrs={"data-component-type": "s-search-result"})
+        for _, result in enumerate(search_results, start=1):
+            # Extract HREF URL
+            href_element = result.find("a", class_="a-link-normal")
+            if href_element:
+                href_url = href_element['href']
+                full_url = "https://amazon.com" + href_url
+            else:
+                full_url = None
+
+            # Extract escaped text (title)
+            title_element = result.find("span", class_="a-size-base-plus")
+            escaped_text = title_element.get_text() if title_element else None
+
+            if title_element is None:
+                title_element = soup.find('h2', class_='a-size-mini')
+                escaped_text = title_element.get_text(strip=True)
+
+            # Extract price
+            price_element = result.find("span", class_="a-offscreen")
+            price = price_element.get_text() if price_element else None
+
+            # Extract list price
+            list_price_element = result.find("span", class_="a-price a-text-price")
+            list_price = list_price_element.find("span", class_="a-offscreen").get_text() if list_price_element else None
+
+            # Extract bestseller status
+            bestseller_element = result.find("span", class_="a-badge-label")
+            bestseller_status = bestseller_element.get_text() if bestseller_element else "Not a Bestseller"
+
+            # Extract star rating
+            star_rating_element = result.find("i", class_="a-icon-star-small")
+            star_rating = star_rating_element.find("span", class_="a-icon-alt").get_text() if star_rating_element else None
+
+            # Print or store the extracted information
+            product_description = None
+            if escaped_text is not None and full_url is not None:
+                product_description = self.add_to_str(product_description, "Product Title", escaped_text)
+                product_description = self.add_to_str(product_description, "Price", price)
+                product_description = self.add_to_str(product_description, "Bestseller Status", bestseller_status)
+                product_description = self.add_to_str(product_description, "Star Rating", star_rating)
+                product_description = self.add_to_str(product_description, "List Price", list_price)
+
+                product = Product.from_page(full_url, escaped_text, price, list_price, star_rating,
+                                            bestseller=bestseller_element is not None)
+                products.append(Action(ActionType.CLICK_SEARCH_RESULT, product_description, full_url, product))
+                if len(products) >= LIMIT:
+                    break
+
+        return products
+
+    def extract_recommendations_from_product_details(self, parsed_page):
+        LIMIT = 5
+
+        soup = parsed_page.document
+
+        recommendations = []
+        product_elements = soup.find_all('li', class_='a-carousel-card')
+
+        for product_element in product_elements:
+            try:
+                product_title = product_element.find('a', class_='a-link-normal')['title']
+                product_url = product_element.find('a', class_='a-link-normal')['href']
+                full_url = "https://amazon.com" + product_url
+                product_price = product_element.find('span', class_='a-size-medium').text
+
+                product_description = None
+
+                if product_title is not None and product_url is not None:
+                    product_description = self.add_to_str(product_description, "Product Title", product_title)
+                    product_description = self.add_to_str(product_description, "Product Price", product_price)
+                    product = Product.from_page(full_url, product_title, product_price)
+                    recommendations.append(Action(ActionType.CLICK_RECOMMENDED, product_description, full_url, product))
+                    if len(recommendations) >= LIMIT:
+                        break
+            except:
+                continue
+
+        return recommendations
+
+    def extract_checkout_from_product_details(self, parsed_page):
+        soup = parsed_page.document
+
+        product_description = ""
+        escaped_title = first_price = average_review = num_ratings = None
+
+        feature_bullets_div = soup.find("div", id="feature-bullets")
+
+        # Find the span element with id "productTitle"
+        product_title_span = soup.find("span", id="productTitle")
+
+        if product_title_span:
+            escaped_title = product_title_span.get_text(strip=True)
+            product_description = self.add_to_str(product_description, "Product Title", escaped_title)
+
+        # Extract the bullet points
+        if feature_bullets_div:
+            bullet_points = feature_bullets_div.find_all("span", class_="a-list-item")
+
+            # TODO: make sure this is working also if there's no bullet points
+            bullet_points = ""
+            for bullet_point in bullet_points:
+                if bullet_point.get_text() != "":
+                    bullet_points += bullet_point.get_text() + "; "
+            product_description = self.add_to_str(product_description, "Product Description", bullet_points)
+
+        # Find the span elements with class "a-price-range"
+        price_range_spans = soup.find_all("span", class_="a-price-range")
+
+        for price_range_span in price_range_spans:
+            # Extract the price from each span
+            price_elements = price_range_span.find_all("span", class_="a-price")
+            for price_element in price_elements:
+                price = price_element.find("span", class_="a-offscreen").get_text()
+                first_price = first_price or price
+                product_description = self.add_to_str(product_description, "Price", price)
+
+        # Find the span element with class "reviewCountTextLinkedHistogram"
+        average_review_span = soup.find("span", class_="reviewCountTextLinkedHistogram")
+
+        if average_review_span:
+            title = average_review_span.get("title")
+            average_review = title.split(" ")[0] if title else None
+            product_description = self.add_to_str(product_description, "Average Review", average_review)
+
+        # Find the span element with id "acrCustomerReviewText"
+        ratings_span = soup.find("span", id="acrCustomerReviewText")
+
+        if ratings_span:
+            num_ratings = ratings_span.get_text().replace(" ratings", "").replace(",", "")
+            product_description = self.add_to_str(product_description, "Number Ratings", num_ratings)
+
+        product = Product.from_page(parsed_page.url, escaped_title, first_price, rating=average_review,
+                                    review_count=num_ratings)
+        return [Action(ActionType.BUY_NOW, product_description, parsed_page.url, product)]
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _first(xpath, element):
+    result = xpath(element)
+    return result[0] if result else None
+
+
+# Strings inside these elements are not part of BeautifulSoup's get_text() output
+_NON_TEXT_TAGS = frozenset(["script", "style", "template", "rt", "rp"])
+
+
+def _strings(element):
+    if element.tag in _NON_TEXT_TAGS:
+        return
+    if element.text:
+        yield element.text
+    for child in element:
+        # Comments and processing instructions have a non-string tag but keep their tail
+        if isinstance(child.tag, str):
+            yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def _get_text(element, strip=False):
+    if strip:
+        return "".join(text.strip() for text in _strings(element) if text.strip())
+    return "".join(_strings(element))
+
+
+class LxmlExtractor(AmazonExtractor):
+    """Runs precompiled XPath expressions directly on the lxml tree.
+
+    Produces the same actions as SoupExtractor, including its quirks, but
+    avoids building and walking a BeautifulSoup tree.
+    """
+    name = "lxml"
+
+    SEARCH_RESULTS     = etree.XPath("//*[@data-component-type='s-search-result']")
+    LINK               = etree.XPath(f"(.//a[{_has_class('a-link-normal')}])[1]")
+    TITLE              = etree.XPath(f"(.//span[{_has_class('a-size-base-plus')}])[1]")
+    FALLBACK_TITLE     = etree.XPath(f"(//h2[{_has_class('a-size-mini')}])[1]")
+    OFFSCREEN          = etree.XPath(f"(.//span[{_has_class('a-offscreen')}])[1]")
+    LIST_PRICE         = etree.XPath("(.//span[normalize-space(@class)='a-price a-text-price'])[1]")
+    BADGE              = etree.XPath(f"(.//span[{_has_class('a-badge-label')}])[1]")
+    STAR_RATING        = etree.XPath(f"(.//i[{_has_class('a-icon-star-small')}])[1]")
+    STAR_RATING_TEXT   = etree.XPath(f"(.//span[{_has_class('a-icon-alt')}])[1]")
+
+    CAROUSEL_CARDS     = etree.XPath(f"//li[{_has_class('a-carousel-card')}]")
+    CARD_PRICE         = etree.XPath(f"(.//span[{_has_class('a-size-medium')}])[1]")
+
+    FEATURE_BULLETS    = etree.XPath("(//div[@id='feature-bullets'])[1]")
+    PRODUCT_TITLE      = etree.XPath("(//span[@id='productTitle'])[1]")
+    PRICE_RANGES       = etree.XPath(f"//span[{_has_class('a-price-range')}]")
+    PRICES             = etree.XPath(f".//span[{_has_class('a-price')}]")
+    AVERAGE_REVIEW     = etree.XPath(f"(//span[{_has_class('reviewCountTextLinkedHistogram')}])[1]")
+    RATINGS            = etree.XPath("(//span[@id='acrCustomerReviewText'])[1]")
+
+    def parse(self, content):
+        encoding = None
+        if isinstance(content, bytes):
+            # Same preference as BeautifulSoup: the declared encoding, otherwise UTF-8
+            encoding = EncodingDetector.find_declared_encoding(content, is_html=True) or "utf-8"
+        return etree.fromstring(content, etree.HTMLParser(encoding=encoding))
+
+    def extract_products_from_search_page(self, parsed_page):
+        LIMIT = 5
+        products = []
+        document = parsed_page.document
+
+        for result in self.SEARCH_RESULTS(document):
+            href_element = _first(self.LINK, result)
+            full_url = "https://amazon.com" + href_element.attrib['href'] if href_element is not None else None
+
+            title_element = _first(self.TITLE, result)
+            if title_element is not None:
+                escaped_text = _get_text(title_element)
+            else:
+                escaped_text = _get_text(_first(self.FALLBACK_TITLE, document), strip=True)
+
+            price_element = _first(self.OFFSCREEN, result)
+            price = _get_text(price_element) if price_element is not None else None
+
+            list_price_element = _first(self.LIST_PRICE, result)
+            list_price = _get_text(_first(self.OFFSCREEN, list_price_element)) if list_price_element is not None else None
+
+            bestseller_element = _first(self.BADGE, result)
+            bestseller_status = _get_text(bestseller_element) if bestseller_element is not None else "Not a Bestseller"
+
+            star_rating_element = _first(self.STAR_RATING, result)
+            star_rating = _get_text(_first(self.STAR_RATING_TEXT, star_rating_element)) if star_rating_element is not None else None
+
+            if escaped_text is not None and full_url is not None:
+                product_description = None
+                product_description = self.add_to_str(product_description, "Product Title", escaped_text)
+                product_description = self.add_to_str(product_description, "Price", price)
+                product_description = self.add_to_str(product_description, "Bestseller Status", bestseller_status)
+                product_description = self.add_to_str(product_description, "Star Rating", star_rating)
+                product_description = self.add_to_str(product_description, "List Price", list_price)
+
+                product = Product.from_page(full_url, escaped_text, price, list_price, star_rating,
+                                            bestseller=bestseller_element is not None)
+                products.append(Action(ActionType.CLICK_SEARCH_RESULT, product_description, full_url, product))
+                if len(products) >= LIMIT:
+                    break
+
+        return products
+
+    def extract_recommendations_from_product_details(self, parsed_page):
+        LIMIT = 5
+        recommendations = []
+
+        for product_element in self.CAROUSEL_CARDS(parsed_page.document):
+            try:
+                link = _first(self.LINK, product_element)
+                product_title = link.attrib['title']
+                product_url = link.attrib['href']
+                full_url = "https://amazon.com" + product_url
+                product_price = _get_text(_first(self.CARD_PRICE, product_element))
+
+                product_description = None
+                product_description = self.add_to_str(product_description, "Product Title", product_title)
+                product_description = self.add_to_str(product_description, "Product Price", product_price)
+                product = Product.from_page(full_url, product_title, product_price)
+                recommendations.append(Action(ActionType.CLICK_RECOMMENDED, product_description, full_url, product))
+                if len(recommendations) >= LIMIT:
+                    break
+            except Exception:
+                continue
+
+        return recommendations
+
+    def extract_checkout_from_product_details(self, parsed_page):
+        document = parsed_page.document
+        product_description = ""
+        product_title = first_price = average_review = num_ratings = None
+
+        product_title_span = _first(self.PRODUCT_TITLE, document)
+        if product_title_span is not None:
+            product_title = _get_text(product_title_span, strip=True)
+            product_description = self.add_to_str(product_description, "Product Title", product_title)
+
+        # SoupExtractor never collects the bullet points, it only records that the section exists
+        if _first(self.FEATURE_BULLETS, document) is not None:
+            product_description = self.add_to_str(product_description, "Product Description", "")
+
+        for price_range_span in self.PRICE_RANGES(document):
+            for price_element in self.PRICES(price_range_span):
+                price = _get_text(_first(self.OFFSCREEN, price_element))
+                first_price = first_price or price
+                product_description = self.add_to_str(product_description, "Price", price)
+
+        average_review_span = _first(self.AVERAGE_REVIEW, document)
+        if average_review_span is not None:
+            title = average_review_span.get("title")
+            average_review = title.split(" ")[0] if title else None
+            product_description = self.add_to_str(product_description, "Average Review", average_review)
+
+        ratings_span = _first(self.RATINGS, document)
+        if ratings_span is not None:
+            num_ratings = _get_text(ratings_span).replace(" ratings", "").replace(",", "")
+            product_description = self.add_to_str(product_description, "Number Ratings", num_ratings)
+
+        product = Product.from_page(parsed_page.url, product_title, first_price, rating=average_review,
+                                    review_count=num_ratings)
+        return [Action(ActionType.BUY_NOW, product_description, parsed_page.url, product)]
+
+
+EXTRACTORS = {extractor.name: extractor for extractor in (SoupExtractor, LxmlExtractor)}
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import urllib3
+
+logger = logging.getLogger('uvicorn')
+
+# Seconds per request, retries after the first attempt, base of the exponential backoff in seconds
+FETCH_TIMEOUT   = float(os.environ.get("FETCH_TIMEOUT", "15"))
+FETCH_RETRIES   = int(os.environ.get("FETCH_RETRIES", "3"))
+FETCH_BACKOFF   = float(os.environ.get("FETCH_BACKOFF", "0.5"))
+# Requests per second and burst allowed for each host, and connections kept alive per host
+FETCH_RATE      = float(os.environ.get("FETCH_RATE", "5"))
+FETCH_BURST     = int(os.environ.get("FETCH_BURST", "10"))
+FETCH_POOL_SIZE = int(os.environ.get("FETCH_POOL_SIZE", "20"))
+
+MAX_BACKOFF = 30.0
+
+# Statuses worth retrying: throttling and server side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Used when fake_useragent cannot load its data (e.g. offline)
+FALLBACK_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/118.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/118.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "Version/17.0 Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:118.0) Gecko/20100101 Firefox/118.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
+]
+
+
+class FetchError(Exception):
+    def __init__(self, url, status=None, message=None):
+        super().__init__(message or f"Fetching {url} failed with status {status}")
+        self.url    = url
+        self.status = status
+
+
+class UserAgentPool:
+    """User agent strings, loaded once and then picked at random for every request."""
+
+    def __init__(self):
+        self._user_agent = None
+        self._lock       = threading.Lock()
+
+    def _load(self):
+        try:
+            from fake_useragent import UserAgent
+            return UserAgent()
+        except Exception:
+            logger.warning("Could not load fake_useragent data, using built-in user agents")
+            return False
+
+    def random(self):
+        if self._user_agent is None:
+            with self._lock:
+                if self._user_agent is None:
+                    self._user_agent = self._load()
+        if self._user_agent:
+            try:
+                return self._user_agent.random
+            except Exception:
+                pass
+        return random.choice(FALLBACK_USER_AGENTS)
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and bursts of up to `burst` requests.
+
+    Callers reserve a token and are told how long to wait for it, so the same
+    bucket throttles threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, rate, burst):
+        self.rate    = rate
+        self.burst   = burst
+        self.tokens  = float(burst)
+        self.updated = time.monotonic()
+        self._lock   = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens  = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def available(self):
+        """Tokens that could be taken right now without waiting."""
+        if self.rate <= 0:
+            return float(self.burst)
+        with self._lock:
+            return min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+
+
+class Fetcher:
+    """Fetches pages over pooled keep-alive connections with gzip, per-host rate limits, timeouts and retries.
+
+    Threads share one urllib3 pool manager; every event loop gets its own
+    aiohttp session. Both go through the same per-host token buckets, so the
+    rate limit holds across sync and async callers. Connection errors,
+    timeouts and RETRY_STATUSES are retried up to `retries` times with
+    exponential backoff and full jitter, honouring Retry-After; any other
+    error status fails at once. Failures raise FetchError.
+    """
+
+    def __init__(self, timeout=None, retries=None, backoff=None, rate=None, burst=None, pool_size=None):
+        self.timeout   = FETCH_TIMEOUT if timeout is None else timeout
+        self.retries   = FETCH_RETRIES if retries is None else retries
+        self.backoff   = FETCH_BACKOFF if backoff is None else backoff
+        self.rate      = FETCH_RATE if rate is None else rate
+        self.burst     = FETCH_BURST if burst is None else burst
+        self.pool_size = FETCH_POOL_SIZE if pool_size is None else pool_size
+        self.user_agents = UserAgentPool()
+        self.pool      = urllib3.PoolManager(num_pools=64, maxsize=self.pool_size, block=False,
+                                             timeout=urllib3.Timeout(total=self.timeout), retries=False)
+        self._buckets  = {}
+        self._sessions = {}
+        self._lock     = threading.Lock()
+
+    def headers(self):
+        return {
+            'User-Agent': self.user_agents.random(),
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate',
+        }
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc.lower()
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(host, TokenBucket(self.rate, self.burst))
+        return bucket
+
+    def has_capacity(self, url, reserve=1):
+        """Whether a request to the host of `url` would leave at least `reserve` tokens for other requests."""
+        return self._bucket(url).available() >= 1 + reserve
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(MAX_BACKOFF, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def fetch(self, url):
+        for attempt in range(self.retries + 1):
+            time.sleep(self._bucket(url).reserve())
+            retry_after = None
+            try:
+                response = self.pool.request("GET", url, headers=self.headers(), decode_content=True)
+                if response.status < 400:
+                    return response.data
+                if response.status not in RETRY_STATUSES:
+                    raise FetchError(url, response.status)
+                error = FetchError(url, response.status)
+                retry_after = response.headers.get("Retry-After")
+            except urllib3.exceptions.HTTPError as e:
+                error = FetchError(url, message=f"Fetching {url} failed: {e!r}")
+            if attempt < self.retries:
+                logger.info(f"{error}, retrying ({attempt + 1}/{self.retries})")
+                time.sleep(self._backoff(attempt, retry_after))
+        raise error
+
+    def session(self):
+        """Returns the aiohttp session of the running event loop, creating it on first use."""
+        loop = asyncio.get_event_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size, keepalive_timeout=30)
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._sessions[loop] = session
+        return session
+
+    async def close_session(self):
+        session = self._sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def fetch_async(self, url):
+        for attempt in range(self.retries + 1):
+            await asyncio.sleep(self._bucket(url).reserve())
+            retry_after = None
+            try:
+                async with self.session().get(url, headers=self.headers()) as response:
+                    if response.status < 400:
+                        return await response.read()
+                    if response.status not in RETRY_STATUSES:
+                        raise FetchError(url, response.status)
+                    error = FetchError(url, response.status)
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = FetchError(url, message=f"Fetching {url} failed: {e!r}")
+            if attempt < self.retries:
+                logger.info(f"{error}, retrying ({attempt + 1}/{self.retries})")
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise error
+
+    def close(self):
+        self.pool.clear()
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = Fetcher()
+    return _fetcher
+
+
+def configure(**kwargs):
+    """Replace the process-wide fetcher, e.g. with other limits for a benchmark."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is not None:
+            _fetcher.close()
+        _fetcher = Fetcher(**kwargs)
+    return _fetcher
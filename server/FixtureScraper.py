@@ -0,0 +1,109 @@
+import asyncio
+import os
+import random
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+from Scraper import AmazonScraper, PageType, DEFAULT_EXTRACTION_BACKEND
+
+SEARCH_RESULT_MARKER = b'data-component-type="s-search-result"'
+HTML_SUFFIXES = (".html", ".htm")
+
+# Median and spread (sigma of a log-normal distribution) of the simulated page fetch latency in seconds
+FIXTURE_LATENCY = float(os.environ.get("FIXTURE_LATENCY", "0.3"))
+FIXTURE_JITTER  = float(os.environ.get("FIXTURE_JITTER", "0.5"))
+
+
+def fixture_url(name, content):
+    """The URL a saved page is served under: search pages are recognised by their markup."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if SEARCH_RESULT_MARKER in content:
+        return f"https://www.amazon.com/s?k={stem}"
+    return f"https://www.amazon.com/{stem}/dp/{stem}"
+
+
+def load_corpus(path):
+    """Returns (url, content) pairs for every .html page in a directory, .zip or .tar(.gz) archive."""
+    files = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(HTML_SUFFIXES):
+                with open(os.path.join(path, name), "rb") as f:
+                    files.append((name, f.read()))
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(archive.namelist()):
+                if name.endswith(HTML_SUFFIXES):
+                    files.append((name, archive.read(name)))
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for member in sorted(archive.getmembers(), key=lambda m: m.name):
+                if member.isfile() and member.name.endswith(HTML_SUFFIXES):
+                    files.append((member.name, archive.extractfile(member).read()))
+    else:
+        raise ValueError(f"{path} is not a directory, zip or tar archive")
+
+    return [(fixture_url(name, content), content) for name, content in files]
+
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def get_corpus(path):
+    """Loads every corpus only once per process, however many scrapers serve it."""
+    with _corpora_lock:
+        corpus = _corpora.get(path)
+        if corpus is None:
+            corpus = Corpus(load_corpus(path))
+            _corpora[path] = corpus
+        return corpus
+
+
+class Corpus:
+    def __init__(self, pages):
+        self.pages = dict(pages)
+        self.urls  = {PageType.SEARCH_RESULTS: [], PageType.PRODUCT_DETAILS: []}
+        for url, content in pages:
+            page_type = PageType.SEARCH_RESULTS if SEARCH_RESULT_MARKER in content else PageType.PRODUCT_DETAILS
+            self.urls[page_type].append(url)
+
+    def page(self, url, page_type):
+        """Returns the page saved under `url`, or else a saved page of `page_type` picked by URL hash."""
+        content = self.pages.get(url)
+        if content is not None or not self.urls[page_type]:
+            return content
+        urls = self.urls[page_type]
+        return self.pages[urls[zlib.crc32(url.encode()) % len(urls)]]
+
+
+class FixtureScraper(AmazonScraper):
+    """AmazonScraper that serves saved pages from a local corpus instead of amazon.com.
+
+    Any search URL is answered with a saved search page and any product URL
+    with a saved product page, so tasks can browse indefinitely. Fetches wait
+    for a log-normally distributed latency; pages still go through the page
+    cache like real ones.
+    """
+
+    def __init__(self, corpus_path, latency=None, jitter=None, extraction_backend=DEFAULT_EXTRACTION_BACKEND):
+        super().__init__(extraction_backend)
+        self.corpus  = get_corpus(corpus_path)
+        self.latency = FIXTURE_LATENCY if latency is None else latency
+        self.jitter  = FIXTURE_JITTER if jitter is None else jitter
+
+    def fetch(self, url):
+        time.sleep(self.delay())
+        return self.corpus.page(url, self.determine_page_type(url))
+
+    async def fetch_async(self, url):
+        await asyncio.sleep(self.delay())
+        return self.corpus.page(url, self.determine_page_type(url))
+
+    def delay(self):
+        if self.latency <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.jitter) * self.latency if self.jitter > 0 else self.latency
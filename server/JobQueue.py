@@ -0,0 +1,116 @@
+import time
+
+import Storage
+
+QUEUED   = "queued"
+LEASED   = "leased"
+DONE     = "done"
+FAILED   = "failed"
+
+DEFAULT_LEASE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS  = 3
+
+
+class JobQueue:
+    """Durable queue of agent tasks stored in the task_queue table of storage.db.
+
+    Workers claim tasks with a lease that they keep renewing with heartbeats.
+    A task whose lease runs out (because its worker died) is handed out again.
+    """
+
+    def __init__(self, storage=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.storage      = storage or Storage.get_storage()
+        self.max_attempts = max_attempts
+
+    def enqueue(self, task_ids, conn=None):
+        """Queues tasks to be claimed in the order given, optionally within the caller's transaction `conn`."""
+        now = time.time()
+        with self.storage.transaction(conn) as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO task_queue (task_id, state, attempts, enqueued_at, updated_at)
+                VALUES (?, ?, 0, ?, ?)
+            ''', [(str(task_id), QUEUED, now + i * 1e-6, now) for i, task_id in enumerate(task_ids)])
+
+    def enqueue_unfinished(self, finished_status):
+        """Queues tasks from agent_tasks that are not finished and were never queued."""
+        now = time.time()
+        with self.storage.pool.transaction() as conn:
+            c = conn.execute('''
+                INSERT OR IGNORE INTO task_queue (task_id, state, attempts, enqueued_at, updated_at)
+                SELECT id, ?, 0, ?, ? FROM agent_tasks
+                WHERE status != ? AND id NOT IN (SELECT task_id FROM task_queue)
+            ''', (QUEUED, now, now, finished_status))
+            return c.rowcount
+
+    def claim(self, owner, limit=1, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Leases up to `limit` queued (or lease-expired) tasks to `owner` and returns their ids."""
+        now = time.time()
+        with self.storage.pool.transaction() as conn:
+            # Take the write lock up front so two workers never claim the same task
+            conn.execute("BEGIN IMMEDIATE")
+            task_ids = [row[0] for row in conn.execute('''
+                SELECT task_id FROM task_queue
+                WHERE state = ? OR (state = ? AND lease_expires < ? AND attempts < ?)
+                ORDER BY enqueued_at
+                LIMIT ?
+            ''', (QUEUED, LEASED, now, self.max_attempts, limit))]
+            conn.executemany('''
+                UPDATE task_queue
+                SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                WHERE task_id = ?
+            ''', [(LEASED, owner, now + lease_seconds, now, task_id) for task_id in task_ids])
+        return task_ids
+
+    def heartbeat(self, owner, task_ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extends the leases `owner` still holds and returns the ids whose lease was lost."""
+        now = time.time()
+        lost = []
+        with self.storage.pool.transaction() as conn:
+            for task_id in task_ids:
+                c = conn.execute('''
+                    UPDATE task_queue
+                    SET lease_expires = ?, updated_at = ?
+                    WHERE task_id = ? AND state = ? AND lease_owner = ?
+                ''', (now + lease_seconds, now, str(task_id), LEASED, owner))
+                if c.rowcount == 0:
+                    lost.append(task_id)
+        return lost
+
+    def complete(self, owner, task_id):
+        self._finish(owner, task_id, DONE, None)
+
+    def fail(self, owner, task_id, error):
+        """Puts the task back in the queue, or marks it failed after `max_attempts` attempts."""
+        with self.storage.pool.connection() as conn:
+            row = conn.execute('SELECT attempts FROM task_queue WHERE task_id = ?', (str(task_id),)).fetchone()
+        state = FAILED if row is None or row[0] >= self.max_attempts else QUEUED
+        self._finish(owner, task_id, state, error)
+
+    def _finish(self, owner, task_id, state, error):
+        with self.storage.pool.transaction() as conn:
+            conn.execute('''
+                UPDATE task_queue
+                SET state = ?, lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?
+                WHERE task_id = ? AND lease_owner = ?
+            ''', (state, error, time.time(), str(task_id), owner))
+
+    def release(self, owner):
+        """Hands every task leased by `owner` back to the queue, e.g. on a clean shutdown."""
+        with self.storage.pool.transaction() as conn:
+            conn.execute('''
+                UPDATE task_queue
+                SET state = ?, lease_owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0), updated_at = ?
+                WHERE state = ? AND lease_owner = ?
+            ''', (QUEUED, time.time(), LEASED, owner))
+
+    def requeue_expired(self):
+        """Re-queues tasks whose worker stopped sending heartbeats; gives up after `max_attempts`."""
+        now = time.time()
+        with self.storage.pool.transaction() as conn:
+            c = conn.execute('''
+                UPDATE task_queue
+                SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                    lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                WHERE state = ? AND lease_expires < ?
+            ''', (self.max_attempts, FAILED, QUEUED, now, LEASED, now))
+            return c.rowcount
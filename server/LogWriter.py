@@ -0,0 +1,167 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+import Storage
+
+logger = logging.getLogger('uvicorn')
+
+LOG        = "log"
+CHECKPOINT = "checkpoint"
+
+# Returned by the queue wait when nothing was submitted while failed rows were waiting to be written again
+_IDLE = object()
+
+
+class LogWriteError(Exception):
+    pass
+
+
+class _Flush:
+    def __init__(self):
+        self.done  = threading.Event()
+        self.error = None
+
+
+class LogWriter:
+    """Buffers action log rows from all running tasks and writes them in batches.
+
+    A batch is flushed with a single executemany/commit once it holds
+    `max_batch` rows or its oldest row is `max_delay` seconds old. Task
+    checkpoints go through the same queue, so a checkpoint is never committed
+    before the log rows of the steps it covers.
+
+    A failed write is retried `retries` times. If it still fails, its rows are
+    kept and written again with the next batch (or after `retry_delay` seconds
+    when nothing else arrives), and flush() raises LogWriteError until they
+    are committed.
+    """
+
+    def __init__(self, max_batch=500, max_delay=0.2, retries=3, retry_delay=1.0):
+        self.max_batch   = max_batch
+        self.max_delay   = max_delay
+        self.retries     = retries
+        self.retry_delay = retry_delay
+        self._queue      = queue.Queue()
+        self._closed     = False
+        self._thread     = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, task, action):
+        self._queue.put((LOG, (
+            str(task.agent.id), str(task.id), str(action.action_id), str(action.action_type),
+            str(action.context), str(action.target_url), action.step, time.time(), action.product
+        )))
+
+    def submit_checkpoint(self, task):
+        self._queue.put((CHECKPOINT, (
+            str(task.id), len(task.actions_history),
+            json.dumps([action.to_dict() for action in task.next_possible_actions]),
+            json.dumps(task.scraper.get_state()), time.time()
+        )))
+
+    def flush(self, timeout=None):
+        """Block until every row submitted before this call has been committed.
+
+        Returns False on timeout and raises LogWriteError if the rows could not be written.
+        """
+        waiter = _Flush()
+        self._queue.put(waiter)
+        if not waiter.done.wait(timeout):
+            return False
+        if waiter.error is not None:
+            raise LogWriteError(f"Action log rows could not be written: {waiter.error!r}") from waiter.error
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        # Rows and checkpoints not committed yet, including those of a failed write
+        rows, checkpoints = [], {}
+        running = True
+        while running:
+            waiters = []
+            try:
+                item = self._queue.get(timeout=self.retry_delay if rows or checkpoints else None)
+            except queue.Empty:
+                item = _IDLE
+            deadline = time.monotonic() + self.max_delay
+
+            while item is not _IDLE:
+                if item is None:
+                    running = False
+                    break
+                if isinstance(item, _Flush):
+                    # Flush requests cut the batch short so callers are not kept waiting
+                    waiters.append(item)
+                    break
+                kind, row = item
+                if kind is LOG:
+                    rows.append(row)
+                else:
+                    # Only the latest checkpoint of a task matters
+                    checkpoints[row[0]] = row
+                if len(rows) + len(checkpoints) >= self.max_batch:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            error = None
+            if rows or checkpoints:
+                error = self._write(rows, list(checkpoints.values()))
+                if error is None:
+                    rows, checkpoints = [], {}
+            for waiter in waiters:
+                waiter.error = error
+                waiter.done.set()
+
+        if rows or checkpoints:
+            logger.error(f"Closed with {len(rows)} action log rows and {len(checkpoints)} checkpoints not written")
+
+    def _write(self, rows, checkpoints):
+        """Writes a batch, retrying failures; returns the last error, or None once it is committed."""
+        for attempt in range(self.retries + 1):
+            try:
+                Storage.get_storage().save_logs(rows, checkpoints)
+                return None
+            except Exception as e:
+                error = e
+                if attempt < self.retries:
+                    time.sleep(min(self.retry_delay, 0.05 * 2 ** attempt))
+        logger.error(f"Failed to write {len(rows)} action log rows and {len(checkpoints)} checkpoints, "
+                     f"keeping them for the next batch: {error!r}")
+        return error
+
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = LogWriter()
+    return _log_writer
+
+
+def close_log_writer():
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is not None:
+            _log_writer.close()
+            _log_writer = None
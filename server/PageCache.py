@@ -0,0 +1,518 @@
+"""Cache of scraped webpages in webpages.db.
+
+    python -m PageCache --db webpages.db --compact
+    python -m PageCache --db webpages.db --train-dictionary
+
+Pages are stored compressed and once per distinct content, under a key with
+tracking parameters stripped from the URL. Entries expire after
+PAGE_CACHE_TTL seconds and the least recently used ones are evicted once
+the stored pages exceed PAGE_CACHE_MAX_BYTES (0 disables either).
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from LRUCache import LRUCache
+from Storage import ConnectionPool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_DB_PATH = "webpages.db"
+DEFAULT_MEMORY_MAX_BYTES   = 256 * 1024 * 1024
+DEFAULT_MEMORY_MAX_ENTRIES = 4096
+
+PAGE_CACHE_CODEC     = os.environ.get("PAGE_CACHE_CODEC", "zstd" if zstandard else "zlib")
+PAGE_CACHE_TTL       = float(os.environ.get("PAGE_CACHE_TTL", "0"))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", "0"))
+
+# Expired and excess entries are evicted after this many stored pages
+EVICT_EVERY = 256
+
+# Result of an in-flight fetch whose leader was interrupted, telling followers to try again
+_ABANDONED = object()
+
+DICTIONARY_SIZE    = 112 * 1024
+DICTIONARY_SAMPLES = 1000
+
+# Query parameters that only track where a click came from and never change the page
+TRACKING_PARAMETERS = {"ref", "ref_", "qid", "sr", "sprefix", "crid", "tag", "linkCode", "linkId", "keywords",
+                       "_encoding", "content-id", "dib", "dib_tag", "smid", "spIA", "hvadid", "hvpos", "hvnetw",
+                       "hvrand", "hvpone", "hvptwo", "hvqmt", "hvdev", "hvdvcmdl", "hvlocint", "hvlocphy",
+                       "hvtargid", "gclid", "fbclid"}
+TRACKING_PREFIXES   = ("utm_", "pd_rd_", "pf_rd_")
+TRACKING_PATH       = re.compile(r"/ref=[^/]*$")
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS page_urls (
+        url TEXT PRIMARY KEY,
+        hash TEXT,
+        fetched_at REAL,
+        accessed_at REAL
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS page_urls_hash ON page_urls (hash)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS page_urls_accessed ON page_urls (accessed_at)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS page_contents (
+        hash TEXT PRIMARY KEY,
+        codec TEXT,
+        dictionary_id INTEGER,
+        size INTEGER,
+        stored_size INTEGER,
+        content BLOB
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS page_dictionaries (
+        id INTEGER PRIMARY KEY,
+        content BLOB,
+        created_at REAL
+    )
+    ''',
+]
+
+
+def normalize_url(url):
+    """Cache key for `url`: tracking parameters and /ref= path segments removed, remaining parameters sorted."""
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if key not in TRACKING_PARAMETERS and not key.startswith(TRACKING_PREFIXES)]
+    path  = TRACKING_PATH.sub("", parts.path)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(sorted(query)), ""))
+
+
+class PageCache:
+    """Cache of scraped webpages backed by webpages.db.
+
+    Reads only take short in-memory locks, never one held across network
+    I/O. Concurrent misses for the same URL are merged into a single fetch
+    (single-flight), while misses for different URLs are fetched in parallel. In-flight fetches are tracked in sharded maps so
+    that registering a fetch only contends with URLs hashing to the same shard.
+
+    Pages are kept in a process-local LRU tier bounded by total bytes and
+    entry count in front of the SQLite tables, so hot pages are served from RAM.
+
+    On disk, page_urls maps normalized URLs to the hash of their content and
+    page_contents holds every distinct content once, compressed with `codec`.
+    Rows of the webpages table of earlier versions are still read, and moved
+    to the new tables when read or compacted.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, shards=16, pool_size=8,
+                 memory_max_bytes=DEFAULT_MEMORY_MAX_BYTES, memory_max_entries=DEFAULT_MEMORY_MAX_ENTRIES,
+                 codec=None, ttl=None, max_bytes=None):
+        self.path      = path
+        self.pool      = ConnectionPool(path, size=pool_size)
+        self.memory    = LRUCache(max_entries=memory_max_entries, max_bytes=memory_max_bytes,
+                                  sizeof=lambda entry: len(entry[0]))
+        self.codec     = codec or PAGE_CACHE_CODEC
+        self.ttl       = PAGE_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = PAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._locks    = [threading.Lock() for _ in range(shards)]
+        self._inflight = [{} for _ in range(shards)]
+        self._codecs   = threading.local()
+        self._dictionaries = {}
+        self._touched  = {}
+        self._puts     = 0
+        self._maintenance_lock = threading.Lock()
+
+        if self.codec == "zstd" and zstandard is None:
+            raise ValueError("PAGE_CACHE_CODEC=zstd needs zstandard: pip install zstandard")
+        if self.codec not in ("zstd", "zlib", "none"):
+            raise ValueError(f"Unknown page cache codec: {self.codec}")
+
+        with self.pool.transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self.legacy = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='webpages'").fetchone() is not None
+            row = conn.execute('SELECT id, content FROM page_dictionaries ORDER BY id DESC LIMIT 1').fetchone()
+        self.dictionary_id = None
+        if row is not None:
+            self.dictionary_id = row[0]
+            self._dictionaries[row[0]] = row[1]
+
+    def _shard(self, key):
+        return zlib.crc32(key.encode()) % len(self._locks)
+
+    def _expired(self, fetched_at, now=None):
+        return self.ttl > 0 and fetched_at is not None and fetched_at < (now or time.time()) - self.ttl
+
+    # Compression
+
+    def _zstd(self, dictionary_id):
+        """Per-thread compressor and decompressor, since zstandard's are not safe to share between threads."""
+        codecs = getattr(self._codecs, "zstd", None)
+        if codecs is None:
+            codecs = self._codecs.zstd = {}
+        pair = codecs.get(dictionary_id)
+        if pair is None:
+            if dictionary_id is None:
+                pair = (zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor())
+            else:
+                dictionary = zstandard.ZstdCompressionDict(self._dictionary(dictionary_id))
+                pair = (zstandard.ZstdCompressor(level=3, dict_data=dictionary),
+                        zstandard.ZstdDecompressor(dict_data=dictionary))
+            codecs[dictionary_id] = pair
+        return pair
+
+    def _dictionary(self, dictionary_id):
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            with self.pool.connection() as conn:
+                dictionary = conn.execute('SELECT content FROM page_dictionaries WHERE id=?',
+                                          (dictionary_id,)).fetchone()[0]
+            self._dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+    def _compress(self, content):
+        """Returns (codec, dictionary_id, compressed content)."""
+        if self.codec == "zstd":
+            return "zstd", self.dictionary_id, self._zstd(self.dictionary_id)[0].compress(content)
+        if self.codec == "zlib":
+            return "zlib", None, zlib.compress(content, 6)
+        return "none", None, content
+
+    def _decompress(self, codec, dictionary_id, content):
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("webpages.db holds zstd compressed pages: pip install zstandard")
+            return self._zstd(dictionary_id)[1].decompress(content)
+        if codec == "zlib":
+            return zlib.decompress(content)
+        return content
+
+    # Reads and writes
+
+    def get(self, url):
+        key = normalize_url(url)
+        content = self._get_memory(key)
+        if content is None:
+            content = self._load(key, url)
+        return content
+
+    def _get_memory(self, key):
+        """The page from the in-memory tier only; never touches the database."""
+        entry = self.memory.get(key)
+        if entry is None or self._expired(entry[1]):
+            return None
+        self._touched[key] = time.time()
+        return entry[0]
+
+    def _load(self, key, url=None):
+        entry = self._read(key, url)
+        if entry is None:
+            return None
+        self.memory.put(key, entry)
+        return entry[0]
+
+    def _read(self, key, url=None):
+        """Returns (content, fetched_at) for the normalized URL `key`, or None if missing or expired."""
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT page_urls.fetched_at, page_contents.codec, page_contents.dictionary_id, page_contents.content
+                FROM page_urls
+                JOIN page_contents ON page_contents.hash = page_urls.hash
+                WHERE page_urls.url = ?
+            ''', (key,)).fetchone()
+        if row is not None:
+            fetched_at, codec, dictionary_id, content = row
+            if self._expired(fetched_at):
+                return None
+            self._touched[key] = time.time()
+            return self._decompress(codec, dictionary_id, content), fetched_at
+
+        if self.legacy:
+            return self._read_legacy(key, url)
+        return None
+
+    def _read_legacy(self, key, url):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT content FROM webpages WHERE url IN (?, ?)', (key, url or key)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        # Legacy rows have no fetch time, so they count as fetched now
+        with self.pool.transaction() as conn:
+            fetched_at = self._write(key, row[0], conn)
+            conn.execute('DELETE FROM webpages WHERE url IN (?, ?)', (key, url or key))
+        return row[0], fetched_at
+
+    def _write(self, key, content, conn=None):
+        digest = hashlib.sha256(content).hexdigest()
+        now    = time.time()
+        if conn is None:
+            with self.pool.transaction() as conn:
+                self._write_rows(conn, key, digest, content, now)
+        else:
+            self._write_rows(conn, key, digest, content, now)
+        return now
+
+    def _write_rows(self, conn, key, digest, content, now):
+        # Identical content under another URL is stored once
+        if conn.execute('SELECT 1 FROM page_contents WHERE hash=?', (digest,)).fetchone() is None:
+            codec, dictionary_id, compressed = self._compress(content)
+            conn.execute('''
+                INSERT OR IGNORE INTO page_contents (hash, codec, dictionary_id, size, stored_size, content)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (digest, codec, dictionary_id, len(content), len(compressed), compressed))
+        conn.execute('INSERT OR REPLACE INTO page_urls (url, hash, fetched_at, accessed_at) VALUES (?, ?, ?, ?)',
+                     (key, digest, now, now))
+
+    def put(self, url, content):
+        key = normalize_url(url)
+        fetched_at = self._write(key, content)
+        self.memory.put(key, (content, fetched_at))
+
+        self._puts += 1
+        if (self.ttl > 0 or self.max_bytes > 0) and self._puts % EVICT_EVERY == 0:
+            self.evict()
+
+    def stats(self):
+        return self.memory.stats()
+
+    def disk_stats(self):
+        with self.pool.connection() as conn:
+            urls = conn.execute('SELECT COUNT(*) FROM page_urls').fetchone()[0]
+            contents, size, stored_size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM page_contents').fetchone()
+            legacy = conn.execute('SELECT COUNT(*) FROM webpages').fetchone()[0] if self.legacy else 0
+        return {
+            'urls': urls,
+            'contents': contents,
+            'bytes': size,
+            'stored_bytes': stored_size,
+            'legacy_pages': legacy,
+        }
+
+    # Eviction and compaction
+
+    def _flush_touched(self, conn):
+        touched, self._touched = self._touched, {}
+        conn.executemany('UPDATE page_urls SET accessed_at = ? WHERE url = ? AND accessed_at < ?',
+                         [(accessed_at, key, accessed_at) for key, accessed_at in touched.items()])
+
+    def evict(self, batch_size=100):
+        """Removes expired pages, then the least recently used ones until the stored pages fit in `max_bytes`."""
+        with self._maintenance_lock, self.pool.transaction() as conn:
+            self._flush_touched(conn)
+            if self.ttl > 0:
+                conn.execute('DELETE FROM page_urls WHERE fetched_at < ?', (time.time() - self.ttl,))
+            conn.execute('DELETE FROM page_contents WHERE hash NOT IN (SELECT hash FROM page_urls)')
+
+            if self.max_bytes > 0:
+                stored_size = conn.execute('SELECT COALESCE(SUM(stored_size), 0) FROM page_contents').fetchone()[0]
+                while stored_size > self.max_bytes:
+                    rows = conn.execute('SELECT url, hash FROM page_urls ORDER BY accessed_at LIMIT ?',
+                                        (batch_size,)).fetchall()
+                    if not rows:
+                        break
+                    for key, digest in rows:
+                        conn.execute('DELETE FROM page_urls WHERE url = ?', (key,))
+                        self.memory.pop(key)
+                        # Content shared with another URL stays
+                        if conn.execute('SELECT 1 FROM page_urls WHERE hash = ?', (digest,)).fetchone() is None:
+                            row = conn.execute('SELECT stored_size FROM page_contents WHERE hash = ?',
+                                               (digest,)).fetchone()
+                            conn.execute('DELETE FROM page_contents WHERE hash = ?', (digest,))
+                            stored_size -= row[0] if row else 0
+                        if stored_size <= self.max_bytes:
+                            break
+
+    def compact(self, batch_size=500):
+        """Moves legacy webpages rows to the new tables, evicts, and returns the freed space to the filesystem."""
+        while self.legacy:
+            with self.pool.transaction() as conn:
+                rows = conn.execute('SELECT url, content FROM webpages LIMIT ?', (batch_size,)).fetchall()
+                for url, content in rows:
+                    if content is not None:
+                        self._write(normalize_url(url), content, conn)
+                conn.executemany('DELETE FROM webpages WHERE url = ?', [(row[0],) for row in rows])
+                if not rows:
+                    conn.execute('DROP TABLE webpages')
+                    self.legacy = False
+
+        self.evict()
+        with self.pool.connection() as conn:
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def train_dictionary(self, size=DICTIONARY_SIZE, samples=DICTIONARY_SAMPLES):
+        """Trains a zstd dictionary on stored pages and compresses new pages with it; returns its id.
+
+        Pages stored earlier keep the dictionary (or none) they were compressed with.
+        """
+        if zstandard is None:
+            raise RuntimeError("Training a dictionary needs zstandard: pip install zstandard")
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT codec, dictionary_id, content FROM page_contents ORDER BY RANDOM() LIMIT ?
+            ''', (samples,)).fetchall()
+        pages = [self._decompress(*row) for row in rows]
+        dictionary = zstandard.train_dictionary(size, pages)
+
+        with self.pool.transaction() as conn:
+            c = conn.execute('INSERT INTO page_dictionaries (content, created_at) VALUES (?, ?)',
+                             (dictionary.as_bytes(), time.time()))
+            dictionary_id = c.lastrowid
+        self._dictionaries[dictionary_id] = dictionary.as_bytes()
+        self.dictionary_id = dictionary_id
+        return dictionary_id
+
+    # Single-flight fetching
+
+    def _join(self, key, shard):
+        """Returns (future, leader): the in-flight fetch of `key`, registering a new one if there is none."""
+        with self._locks[shard]:
+            future = self._inflight[shard].get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[shard][key] = future
+        return future, leader
+
+    def _settle(self, key, shard, future, content=None, error=None):
+        # Unregistered before waking followers, so a follower that retries never finds the settled future
+        with self._locks[shard]:
+            del self._inflight[shard][key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(content)
+
+    def get_or_fetch(self, url, fetch):
+        content = self.get(url)
+        if content is not None:
+            return content
+
+        key = normalize_url(url)
+        shard = self._shard(key)
+        while True:
+            future, leader = self._join(key, shard)
+            if leader:
+                break
+            content = future.result()
+            if content is not _ABANDONED:
+                return content
+            # The leader gave up without failing; try again, perhaps as the new leader
+
+        try:
+            # Another leader may have stored the page between our read and registering
+            content = self._load(key, url)
+            if content is None:
+                content = fetch(url)
+                if content is not None:
+                    self.put(url, content)
+        except Exception as e:
+            self._settle(key, shard, future, error=e)
+            raise
+        except BaseException:
+            # Interrupted (e.g. cancelled) rather than failed: followers retry instead of failing too
+            self._settle(key, shard, future, _ABANDONED)
+            raise
+        self._settle(key, shard, future, content)
+        return content
+
+    async def get_or_fetch_async(self, url, fetch_async):
+        """Like get_or_fetch, but awaits `fetch_async` and shares in-flight fetches with threaded callers.
+
+        Only memory hits are served on the event loop; database reads and
+        writes, (de)compression and eviction run in the default executor.
+        Cancelling a caller never cancels the fetch for the others waiting on it.
+        """
+        key = normalize_url(url)
+        content = self._get_memory(key)
+        if content is not None:
+            return content
+
+        loop = asyncio.get_event_loop()
+        content = await loop.run_in_executor(None, self._load, key, url)
+        if content is not None:
+            return content
+
+        shard = self._shard(key)
+        while True:
+            future, leader = self._join(key, shard)
+            if leader:
+                break
+            # Shielded, since cancelling a wrapped future cancels the future it wraps
+            content = await asyncio.shield(asyncio.wrap_future(future))
+            if content is not _ABANDONED:
+                return content
+
+        try:
+            content = await loop.run_in_executor(None, self._load, key, url)
+            if content is None:
+                content = await fetch_async(url)
+                if content is not None:
+                    await loop.run_in_executor(None, self.put, url, content)
+        except Exception as e:
+            self._settle(key, shard, future, error=e)
+            raise
+        except BaseException:
+            self._settle(key, shard, future, _ABANDONED)
+            raise
+        self._settle(key, shard, future, content)
+        return content
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    global _page_cache
+    if _page_cache is None:
+        with _page_cache_lock:
+            if _page_cache is None:
+                _page_cache = PageCache(DEFAULT_DB_PATH)
+    return _page_cache
+
+
+def configure(path, **kwargs):
+    """Point the process-wide page cache at another database file (e.g. for benchmarks)."""
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is not None:
+            _page_cache.pool.close()
+        _page_cache = PageCache(path, **kwargs)
+    return _page_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--train-dictionary", action="store_true",
+                        help="train a zstd dictionary on the stored pages and use it for new pages")
+    parser.add_argument("--compact", action="store_true",
+                        help="convert legacy rows, evict expired and excess pages and vacuum the database")
+    args = parser.parse_args()
+
+    page_cache = PageCache(args.db)
+    try:
+        if args.train_dictionary:
+            print(f"trained dictionary {page_cache.train_dictionary()}")
+        if args.compact:
+            page_cache.compact()
+        print(page_cache.disk_stats())
+    finally:
+        page_cache.pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import json
+import random
+import time
+import uuid
+from itertools import accumulate
+
+import Storage
+
+# Upper bound on the agents a single population may have
+MAX_POPULATION_SIZE = 1000000
+
+DEFAULT_GENDERS    = {"female": 0.5, "male": 0.5}
+DEFAULT_AGE_RANGES = [(18, 24, 0.14), (25, 34, 0.22), (35, 44, 0.2), (45, 54, 0.18), (55, 64, 0.15), (65, 80, 0.11)]
+DEFAULT_LOCATIONS  = {"New York, NY": 0.2, "Los Angeles, CA": 0.15, "Chicago, IL": 0.12, "Houston, TX": 0.1,
+                      "Phoenix, AZ": 0.08, "Philadelphia, PA": 0.08, "Seattle, WA": 0.08, "Denver, CO": 0.07,
+                      "Miami, FL": 0.07, "Boston, MA": 0.05}
+DEFAULT_INTERESTS  = {"running": 1, "hiking": 1, "cooking": 1, "gaming": 1, "photography": 1, "gardening": 1,
+                      "fitness": 1, "reading": 1, "travel": 1, "music": 1, "fashion": 1, "home decor": 1,
+                      "camping": 1, "cycling": 1, "yoga": 1, "pets": 1, "technology": 1, "outdoors": 1,
+                      "sports": 1, "crafts": 1, "coffee": 1, "skincare": 1, "parenting": 1, "fishing": 1}
+
+
+class PopulationSpec:
+    """Distributions personas are drawn from.
+
+    `genders`, `locations` and `interests` map values to weights; `age_ranges`
+    are (age_from, age_to, weight). Every persona gets between `min_interests`
+    and `max_interests` distinct interests.
+    """
+
+    def __init__(self, genders=None, age_ranges=None, locations=None, interests=None,
+                 min_interests=2, max_interests=4, name_prefix="persona"):
+        self.genders       = genders or DEFAULT_GENDERS
+        self.age_ranges    = [tuple(age_range) for age_range in age_ranges or DEFAULT_AGE_RANGES]
+        self.locations     = locations or DEFAULT_LOCATIONS
+        self.interests     = interests or DEFAULT_INTERESTS
+        self.min_interests = min_interests
+        self.max_interests = max_interests
+        self.name_prefix   = name_prefix
+
+        available = sum(1 for weight in self.interests.values() if weight > 0)
+        if not 0 < min_interests <= max_interests <= available:
+            raise ValueError(f"Interests per persona must be between 1 and {available}, "
+                             f"got {min_interests}-{max_interests}")
+        for name, weights in (("genders", self.genders.values()), ("locations", self.locations.values()),
+                              ("interests", self.interests.values()),
+                              ("age_ranges", [weight for _, _, weight in self.age_ranges])):
+            if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+                raise ValueError(f"Weights of {name} must not be negative and not all zero")
+        if any(age_from > age_to for age_from, age_to, _ in self.age_ranges):
+            raise ValueError("Age ranges must have age_from <= age_to")
+
+    def to_dict(self):
+        return {
+            'genders': self.genders,
+            'age_ranges': [list(age_range) for age_range in self.age_ranges],
+            'locations': self.locations,
+            'interests': self.interests,
+            'min_interests': self.min_interests,
+            'max_interests': self.max_interests,
+            'name_prefix': self.name_prefix,
+        }
+
+
+class _Sampler:
+    def __init__(self, weights):
+        self.values  = list(weights)
+        self.weights = list(accumulate(weights.values()))
+
+    def sample(self, rng, k=1):
+        return rng.choices(self.values, cum_weights=self.weights, k=k)
+
+
+def generate(spec, size, seed):
+    """Yields `size` (name, gender, age_from, age_to, location, interests) personas; the same seed gives the same personas."""
+    rng       = random.Random(seed)
+    genders   = _Sampler(spec.genders)
+    locations = _Sampler(spec.locations)
+    ages      = _Sampler({(age_from, age_to): weight for age_from, age_to, weight in spec.age_ranges})
+    interests = _Sampler(spec.interests)
+    width     = len(str(size))
+
+    # Drawing each attribute for the whole population at once is much faster than persona by persona
+    chosen_genders   = genders.sample(rng, size)
+    chosen_ages      = ages.sample(rng, size)
+    chosen_locations = locations.sample(rng, size)
+    counts = rng.choices(range(spec.min_interests, spec.max_interests + 1), k=size)
+
+    for i in range(size):
+        chosen = []
+        while len(chosen) < counts[i]:
+            for interest in interests.sample(rng, counts[i] - len(chosen)):
+                if interest not in chosen:
+                    chosen.append(interest)
+        age_from, age_to = chosen_ages[i]
+        yield (f"{spec.name_prefix}-{i + 1:0{width}d}", chosen_genders[i], age_from, age_to, chosen_locations[i], chosen)
+
+
+def create_population(size, spec=None, seed=None, storage=None):
+    """Generates `size` agents with their profiles and saves them in one transaction; returns the population id and seed."""
+    if not 0 < size <= MAX_POPULATION_SIZE:
+        raise ValueError(f"Population size must be between 1 and {MAX_POPULATION_SIZE}")
+    spec    = spec or PopulationSpec()
+    seed    = random.SystemRandom().randrange(2 ** 32) if seed is None else seed
+    storage = storage or Storage.get_storage()
+
+    population_id = str(uuid.uuid1())
+    # Random UUIDs whose last 48 bits count up: unique without generating a UUID per row
+    agent_prefix, profile_prefix = str(uuid.uuid4())[:24], str(uuid.uuid4())[:24]
+    profiles, agents = [], []
+    for i, (name, gender, age_from, age_to, location, interests) in enumerate(generate(spec, size, seed)):
+        profile_id = f"{profile_prefix}{i:012x}"
+        profiles.append((profile_id, gender, age_from, age_to, location, ', '.join(interests), None))
+        agents.append((f"{agent_prefix}{i:012x}", name, profile_id, population_id))
+
+    storage.save_population((population_id, seed, size, json.dumps(spec.to_dict()), time.time()), profiles, agents)
+    return population_id, seed
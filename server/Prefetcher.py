@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+
+from Action import ActionType
+from Fetcher import get_fetcher
+
+logger = logging.getLogger('uvicorn')
+
+# Prefetches running at once per event loop (0 turns prefetching off), and candidates prefetched per decision
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "16"))
+PREFETCH_CANDIDATES  = int(os.environ.get("PREFETCH_CANDIDATES", "4"))
+
+
+class PrefetchGroup:
+    """The prefetches started for one decision of one task."""
+
+    def __init__(self, prefetcher, scraper):
+        self.prefetcher = prefetcher
+        self.scraper    = scraper
+        self.settled    = False
+        self.chosen     = None
+        self.tasks      = {}
+        self.started    = set()
+
+    async def _prefetch(self, url):
+        loop = asyncio.get_event_loop()
+        async with self.prefetcher.slots:
+            if self.settled:
+                return
+            # Never spend rate limit tokens that a task needs right now
+            if not get_fetcher().has_capacity(url) and \
+                    await loop.run_in_executor(None, self.scraper.page_cache.get, url) is None:
+                self.prefetcher.stats["skipped"] += 1
+                return
+            self.started.add(url)
+            self.prefetcher.stats["started"] += 1
+            try:
+                content = await self.scraper.scrape_and_cache_async(url)
+                if content is not None and (not self.settled or url == self.chosen):
+                    # Parsing fills the extraction cache; done off the loop so it does not hold up other tasks
+                    await loop.run_in_executor(None, self.scraper.actions_from_content, url, content)
+            except Exception as e:
+                # The task fetches the page itself if it needs it
+                logger.debug(f"Prefetching {url} failed: {e!r}")
+
+    async def settle(self, url=None):
+        """Called once the task has chosen: waits for a running prefetch of `url` and drops the rest.
+
+        Prefetches still waiting for a slot are cancelled; running ones are left
+        to finish, since other tasks may be waiting on the same fetch, but skip parsing.
+        """
+        self.chosen  = url
+        self.settled = True
+        chosen = self.tasks.pop(url, None)
+        for task_url, task in self.tasks.items():
+            if task_url not in self.started:
+                task.cancel()
+                self.prefetcher.stats["cancelled"] += 1
+        if chosen is None:
+            return
+        if url in self.started:
+            self.prefetcher.stats["used"] += 1
+            await asyncio.shield(chosen)
+        else:
+            chosen.cancel()
+            self.prefetcher.stats["cancelled"] += 1
+
+    def cancel(self):
+        self.settled = True
+        for task_url, task in self.tasks.items():
+            if task_url not in self.started:
+                task.cancel()
+
+
+class Prefetcher:
+    """Fetches and parses the pages a task may go to next while it waits for its decision.
+
+    At most `max_concurrency` prefetches run at once. Only the first
+    `max_candidates` candidate actions that lead to another page are
+    prefetched, in the order they appear on the page.
+    """
+
+    def __init__(self, max_concurrency=PREFETCH_CONCURRENCY, max_candidates=PREFETCH_CANDIDATES):
+        self.max_candidates = max_candidates
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.stats = {"started": 0, "skipped": 0, "cancelled": 0, "used": 0}
+
+    def prefetch(self, scraper, actions):
+        group = PrefetchGroup(self, scraper)
+        for action in actions:
+            if len(group.tasks) >= self.max_candidates:
+                break
+            url = action.target_url
+            if action.action_type is ActionType.BUY_NOW or not url or url in group.tasks:
+                continue
+            group.tasks[url] = asyncio.ensure_future(group._prefetch(url))
+        return group
+
+
+_prefetchers = {}
+
+
+def get_prefetcher():
+    """Returns the prefetcher of the running event loop, or None when prefetching is disabled."""
+    if PREFETCH_CONCURRENCY <= 0 or PREFETCH_CANDIDATES <= 0:
+        return None
+    loop = asyncio.get_event_loop()
+    prefetcher = _prefetchers.get(loop)
+    if prefetcher is None:
+        prefetcher = Prefetcher()
+        _prefetchers[loop] = prefetcher
+    return prefetcher
@@ -0,0 +1,59 @@
+import re
+
+ASIN_PATTERN   = re.compile(r"/(?:dp|gp/product|gp/aw/d)/([A-Za-z0-9_-]+)")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def asin_from_url(url):
+    match = ASIN_PATTERN.search(url or "")
+    return match.group(1) if match else None
+
+
+def parse_number(text):
+    """The first number in `text` ("$1,299.99" -> 1299.99, "4.5 out of 5 stars" -> 4.5), or None."""
+    match = NUMBER_PATTERN.search(text or "")
+    if match is None:
+        return None
+    return float(match.group(0).replace(",", ""))
+
+
+class Product:
+    """Structured product data extracted from a page, stored once per ASIN in the products table."""
+
+    def __init__(self, asin, title=None, price=None, list_price=None, rating=None, review_count=None, bestseller=None):
+        self.asin         = asin
+        self.title        = title
+        self.price        = price
+        self.list_price   = list_price
+        self.rating       = rating
+        self.review_count = review_count
+        self.bestseller   = bestseller
+
+    def from_page(url, title=None, price=None, list_price=None, rating=None, review_count=None, bestseller=None):
+        """Builds a Product from the strings found on a page; returns None if the URL has no ASIN."""
+        asin = asin_from_url(url)
+        if asin is None:
+            return None
+        review_count = parse_number(review_count)
+        return Product(asin, title, parse_number(price), parse_number(list_price), parse_number(rating),
+                       None if review_count is None else int(review_count), bestseller)
+
+    def to_dict(self):
+        return {
+            'asin': self.asin,
+            'title': self.title,
+            'price': self.price,
+            'list_price': self.list_price,
+            'rating': self.rating,
+            'review_count': self.review_count,
+            'bestseller': self.bestseller,
+        }
+
+    def from_dict(data):
+        return Product(**data)
+
+    def __eq__(self, other):
+        return isinstance(other, Product) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Product({self.to_dict()})"
@@ -0,0 +1,114 @@
+import os
+
+from Action import Action
+
+# "json" renders every action as indented JSON with its UUID (the original format), "compact" as one short line
+PROMPT_ENCODING       = os.environ.get("PROMPT_ENCODING", "json")
+# Number of most recent history steps shown in full by the compact encoding; 0 shows all of them
+PROMPT_HISTORY_WINDOW = int(os.environ.get("PROMPT_HISTORY_WINDOW", "0"))
+
+
+class JsonEncoding:
+    name = "json"
+
+    def encode(self, options, history, stable_ids=False):
+        """Returns the options and previous actions as text for the prompt."""
+        option_ids = history_ids = None
+        if stable_ids:
+            option_ids  = [f"option-{i}" for i in range(1, len(options) + 1)]
+            history_ids = [f"step-{i}" for i in range(1, len(history) + 1)]
+
+        return Action.array_to_json(options, option_ids), Action.array_to_json(history, history_ids)
+
+    def resolve(self, options, answer):
+        """Returns the option the LLM's answer refers to, or None."""
+        for action in options:
+            if str(action.action_id).strip() == str(answer).strip():
+                return action
+        return None
+
+
+class CompactEncoding:
+    """One line per action with short aliases instead of UUIDs.
+
+    Options are called o1, o2, ... and previous actions h1, h2, ... (their
+    step), so aliases are stable across tasks. Fields repeated inside a context
+    are dropped, and a context that was already shown is replaced by a
+    reference to the action that showed it. With a `history_window`, only the
+    most recent steps are shown in full and older ones are summarised.
+    """
+    name = "compact"
+
+    HEADER = "Each line is: action ID | action type | details\n"
+
+    def __init__(self, history_window=PROMPT_HISTORY_WINDOW, summary_length=60):
+        self.history_window = history_window
+        self.summary_length = summary_length
+
+    def encode(self, options, history, stable_ids=False):
+        seen = {}
+        start = len(history) - self.history_window if 0 < self.history_window < len(history) else 0
+
+        previous_actions = ""
+        if start > 0:
+            summary = " > ".join(f"{self.type_name(action)} {self.shorten(action.context)}" for action in history[:start])
+            previous_actions += f"h1-h{start} (summary): {summary}\n"
+        for step, action in enumerate(history[start:], start=start + 1):
+            previous_actions += self.line(f"h{step}", action, seen)
+
+        options_text = self.HEADER
+        for i, action in enumerate(options, start=1):
+            options_text += self.line(self.alias(i), action, seen)
+
+        if previous_actions:
+            previous_actions = self.HEADER + previous_actions
+        return options_text, previous_actions
+
+    def resolve(self, options, answer):
+        answer = str(answer).strip().strip("\"'`.").lower()
+        for i, action in enumerate(options, start=1):
+            if answer == self.alias(i):
+                return action
+        # The model may still answer with a real id
+        return JsonEncoding().resolve(options, answer)
+
+    def alias(self, i):
+        return f"o{i}"
+
+    def line(self, alias, action, seen):
+        context = self.compact(action.context)
+        if context in seen:
+            context = f"same as {seen[context]}"
+        elif context:
+            seen[context] = alias
+        return f"{alias} | {self.type_name(action)} | {context}\n"
+
+    def type_name(self, action):
+        # History loaded from the logs table has "ActionType.X" strings instead of members
+        return str(action.action_type).split(".")[-1]
+
+    def compact(self, context):
+        fields = []
+        for field in str(context or "").split(";"):
+            field = " ".join(field.split())
+            if field and field not in fields:
+                fields.append(field)
+        return "; ".join(fields)
+
+    def shorten(self, context):
+        context = self.compact(context)
+        if len(context) > self.summary_length:
+            context = context[:self.summary_length].rstrip() + "..."
+        return f"({context})" if context else ""
+
+
+ENCODINGS = {JsonEncoding.name: JsonEncoding, CompactEncoding.name: CompactEncoding}
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = ENCODINGS[PROMPT_ENCODING]()
+    return _encoding
@@ -0,0 +1,148 @@
+import os
+import threading
+
+import Storage
+from Agent import Agent
+from AgentTask import AgentTask, TaskStatus
+from LRUCache import LRUCache
+from Scraper import create_scraper
+from UserProfile import UserProfile
+
+# Upper bound on the agents and tasks kept in memory; the rest are loaded from storage.db when needed
+AGENT_CACHE_SIZE = int(os.environ.get("AGENT_CACHE_SIZE", "10000"))
+TASK_CACHE_SIZE  = int(os.environ.get("TASK_CACHE_SIZE", "10000"))
+
+
+def agent_from_row(row):
+    agent_id, name, user_profile_id, gender, age_from, age_to, location, interests_str, description = row
+    user_profile = UserProfile(gender, age_from, age_to, location, interests_str.split(', '), description)
+    user_profile.id = user_profile_id
+    return Agent(agent_id, name, user_profile)
+
+
+def task_from_row(row, agent=None):
+    """Builds an AgentTask from a Storage.load_task row; its history is only loaded once it runs."""
+    agent_id, agent_name, gender, age_from, age_to, location, interests_str, description, task_id, initial_goal, status = row
+    if agent is None:
+        user_profile = UserProfile(gender, age_from, age_to, location, interests_str.split(', '), description)
+        agent = Agent(agent_id, agent_name, user_profile)
+    task = AgentTask(agent, create_scraper(), initial_goal)
+    task.id = task_id
+    task.status = TaskStatus(status)
+    return task
+
+
+class AgentRepository:
+    """Loads agents from storage on demand and keeps the recently used ones in an LRU identity map.
+
+    Within the map, every agent id resolves to the same Agent object.
+    """
+
+    def __init__(self, storage=None, max_entries=AGENT_CACHE_SIZE):
+        self.storage  = storage or Storage.get_storage()
+        self.agents   = LRUCache(max_entries=max_entries)
+        self._lock    = threading.Lock()
+
+    def add(self, agent):
+        agent.user_profile.persist()
+        agent.persist()
+        self.agents.put(str(agent.id), agent)
+
+    def add_all(self, agents, conn=None):
+        """Saves agents and their profiles in one transaction, or within the caller's transaction `conn`."""
+        with self.storage.transaction(conn) as conn:
+            self.storage.save_user_profiles([agent.user_profile for agent in agents], conn)
+            self.storage.save_agents(agents, conn)
+        for agent in agents:
+            self.agents.put(str(agent.id), agent)
+
+    def get(self, agent_id):
+        agent = self.agents.get(agent_id)
+        if agent is not None:
+            return agent
+
+        row = self.storage.load_agent(agent_id)
+        if row is None:
+            return None
+        with self._lock:
+            # Another request may have loaded it meanwhile
+            agent = self.agents.get(agent_id)
+            if agent is None:
+                agent = agent_from_row(row)
+                self.agents.put(agent_id, agent)
+        return agent
+
+    def list(self, offset=0, limit=1000):
+        """Agents straight from storage, without filling the identity map."""
+        return [self.agents.get(row[0]) or agent_from_row(row) for row in self.storage.list_agents(offset, limit)]
+
+    def population(self, population_id):
+        """Agents of a population straight from storage, without filling the identity map."""
+        return [self.agents.get(row[0]) or agent_from_row(row)
+                for row in self.storage.list_population_agents(population_id)]
+
+    def delete(self, agent_id):
+        agent = self.get(agent_id)
+        if agent is None:
+            return None
+        self.storage.delete_agent(agent_id)
+        self.agents.pop(agent_id)
+        return agent
+
+
+class TaskRepository:
+    """Loads tasks from storage on demand and keeps the recently used ones in an LRU identity map."""
+
+    def __init__(self, agents, storage=None, max_entries=TASK_CACHE_SIZE):
+        self.agent_repository = agents
+        self.storage = storage or Storage.get_storage()
+        self.tasks   = LRUCache(max_entries=max_entries)
+        self._lock   = threading.Lock()
+
+    def add_all(self, tasks, conn=None):
+        self.storage.save_tasks(tasks, conn)
+        for task in tasks:
+            self.tasks.put(str(task.id), task)
+
+    def get(self, task_id):
+        task = self.tasks.get(task_id)
+        if task is not None:
+            return task
+
+        row = self.storage.load_task(task_id)
+        if row is None:
+            return None
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                task = task_from_row(row, self.agent_repository.get(row[0]))
+                self.tasks.put(task_id, task)
+        return task
+
+    def list(self, offset=0, limit=1000, agent_id=None):
+        """(id, initial_goal, status) rows straight from storage."""
+        return self.storage.list_tasks(offset, limit, agent_id)
+
+
+_agent_repository = None
+_task_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_agent_repository():
+    global _agent_repository
+    if _agent_repository is None:
+        with _repository_lock:
+            if _agent_repository is None:
+                _agent_repository = AgentRepository()
+    return _agent_repository
+
+
+def get_task_repository():
+    global _task_repository
+    if _task_repository is None:
+        agents = get_agent_repository()
+        with _repository_lock:
+            if _task_repository is None:
+                _task_repository = TaskRepository(agents)
+    return _task_repository
@@ -0,0 +1,584 @@
+import contextlib
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_DB_PATH = "storage.db"
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_profiles (
+        id TEXT PRIMARY KEY,
+        gender TEXT,
+        age_from INTEGER,
+        age_to INTEGER,
+        location TEXT,
+        interests TEXT,
+        description TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS agents (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        user_profile_id TEXT,
+        population_id TEXT,
+        FOREIGN KEY (user_profile_id) REFERENCES user_profiles (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS agent_tasks (
+        id TEXT PRIMARY KEY,
+        agent_id TEXT,
+        initial_goal TEXT,
+        status INTEGER,
+        FOREIGN KEY (agent_id) REFERENCES agents (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS logs (
+        agent_id TEXT,
+        task_id TEXT,
+        action_id TEXT PRIMARY KEY,
+        action_type TEXT,
+        context TEXT,
+        target_url TEXT,
+        step INTEGER,
+        timestamp REAL,
+        product_id INTEGER REFERENCES products (id),
+        context_id INTEGER REFERENCES action_contexts (id),
+        seq INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        asin TEXT UNIQUE,
+        title TEXT,
+        price REAL,
+        list_price REAL,
+        rating REAL,
+        review_count INTEGER,
+        bestseller INTEGER,
+        updated_at REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS task_queue (
+        task_id TEXT PRIMARY KEY,
+        state TEXT,
+        lease_owner TEXT,
+        lease_expires REAL,
+        attempts INTEGER,
+        enqueued_at REAL,
+        updated_at REAL,
+        last_error TEXT,
+        FOREIGN KEY (task_id) REFERENCES agent_tasks (id)
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS task_queue_state ON task_queue (state, enqueued_at)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS task_checkpoints (
+        task_id TEXT PRIMARY KEY,
+        step INTEGER,
+        next_actions TEXT,
+        scraper_state TEXT,
+        updated_at REAL,
+        FOREIGN KEY (task_id) REFERENCES agent_tasks (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS populations (
+        id TEXT PRIMARY KEY,
+        seed INTEGER,
+        size INTEGER,
+        spec TEXT,
+        created_at REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS action_contexts (
+        id INTEGER PRIMARY KEY,
+        hash TEXT UNIQUE,
+        context TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    )
+    ''',
+]
+
+# Columns added after the first release, created on databases that predate them
+COLUMNS = [
+    ('logs', 'timestamp', 'REAL'),
+    ('logs', 'product_id', 'INTEGER REFERENCES products (id)'),
+    ('agents', 'population_id', 'TEXT'),
+    ('logs', 'context_id', 'INTEGER REFERENCES action_contexts (id)'),
+    ('logs', 'seq', 'INTEGER'),
+]
+
+# Created after COLUMNS, since they may index added columns
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS logs_task_step ON logs (task_id, step)',
+    'CREATE INDEX IF NOT EXISTS logs_agent ON logs (agent_id)',
+    'CREATE INDEX IF NOT EXISTS logs_timestamp ON logs (timestamp)',
+    'CREATE INDEX IF NOT EXISTS logs_product ON logs (product_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS logs_seq ON logs (seq)',
+    'CREATE INDEX IF NOT EXISTS agent_tasks_agent ON agent_tasks (agent_id)',
+    'CREATE INDEX IF NOT EXISTS agents_population ON agents (population_id)',
+]
+
+
+class ConnectionPool:
+    """Thread-safe pool of sqlite connections to a single database file in WAL mode."""
+
+    def __init__(self, path, size=8, timeout=30.0):
+        self.path    = path
+        self.timeout = timeout
+        self._idle   = queue.LifoQueue(maxsize=size)
+        self._slots  = threading.BoundedSemaphore(size)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put_nowait(conn)
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class Storage:
+    """Repository for everything persisted in storage.db.
+
+    The schema is created once when the storage is constructed; all model
+    classes go through the methods below instead of opening their own connections.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=8):
+        self.path = path
+        self.pool = ConnectionPool(path, size=pool_size)
+        self.init_schema()
+
+    def init_schema(self):
+        with self.pool.transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for table, column, column_type in COLUMNS:
+                if column not in [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            for statement in INDEXES:
+                conn.execute(statement)
+            if conn.execute("SELECT 1 FROM sequences WHERE name = 'logs'").fetchone() is None:
+                # Rows logged before seq existed keep their rowid, which was their cursor until then
+                conn.execute('UPDATE logs SET seq = rowid WHERE seq IS NULL')
+                conn.execute("INSERT INTO sequences (name, value) SELECT 'logs', COALESCE(MAX(seq), 0) FROM logs")
+
+    @contextlib.contextmanager
+    def transaction(self, conn=None):
+        """A transaction on a pooled connection, or `conn` when the caller already has one open."""
+        if conn is not None:
+            yield conn
+            return
+        with self.pool.transaction() as conn:
+            yield conn
+
+    def table_exists(self, table_name):
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+                SELECT name FROM sqlite_master WHERE type='table' AND name=?
+            ''', (table_name,))
+            return c.fetchone() is not None
+
+    def save_user_profiles(self, user_profiles, conn=None):
+        rows = [(
+            str(profile.id), profile.gender, profile.age_from, profile.age_to, profile.location,
+            ', '.join(profile.interests), profile.description
+        ) for profile in user_profiles]
+
+        with self.transaction(conn) as conn:
+            conn.executemany('''
+                INSERT INTO user_profiles (id, gender, age_from, age_to, location, interests, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+    def save_agents(self, agents, conn=None):
+        rows = [(str(agent.id), agent.name, str(agent.user_profile.id)) for agent in agents]
+
+        with self.transaction(conn) as conn:
+            conn.executemany('''
+                INSERT INTO agents (id, name, user_profile_id)
+                VALUES (?, ?, ?)
+            ''', rows)
+
+    def save_tasks(self, tasks, conn=None):
+        rows = [(str(task.id), str(task.agent.id), task.initial_goal, task.status.value) for task in tasks]
+
+        with self.transaction(conn) as conn:
+            conn.executemany('''
+                INSERT INTO agent_tasks (id, agent_id, initial_goal, status)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+
+    def update_task_status(self, task_id, status):
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                UPDATE agent_tasks
+                SET status = ?
+                WHERE id = ?
+            ''', (status.value, str(task_id)))
+
+    def save_logs(self, rows, checkpoints=()):
+        """Insert (agent_id, task_id, action_id, action_type, context, target_url, step, timestamp, product) rows in one transaction.
+
+        `product` is the Product the action refers to, or None. Products are
+        upserted by ASIN and the log row references them by id. The context of
+        such an action describes the product, and many tasks see the same one,
+        so it is stored once in action_contexts and referenced by id as well.
+        Every row gets the next `seq`, the cursor of query_logs.
+        `checkpoints` are (task_id, step, next_actions, scraper_state, updated_at) rows
+        written in the same transaction, replacing the previous checkpoint of each task.
+        """
+        with self.pool.transaction() as conn:
+            product_ids = self._save_products(conn, [row[8] for row in rows if row[8] is not None])
+            context_ids = self._save_contexts(conn, [row[4] for row in rows if row[8] is not None])
+            first_seq   = self._next_sequence(conn, 'logs', len(rows)) if rows else None
+            conn.executemany('''
+                INSERT OR IGNORE INTO logs (agent_id, task_id, action_id, action_type, context, target_url, step, timestamp,
+                                            product_id, context_id, seq)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(row[:8] + (None, None) if row[8] is None else
+                   row[:4] + (None,) + row[5:8] + (product_ids[row[8].asin], context_ids[row[4]])) + (first_seq + i,)
+                  for i, row in enumerate(rows)])
+            conn.executemany('''
+                INSERT OR REPLACE INTO task_checkpoints (task_id, step, next_actions, scraper_state, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', checkpoints)
+
+    def _save_products(self, conn, products):
+        """Upserts products by ASIN, keeping known fields a page did not show, and returns {asin: id}."""
+        if not products:
+            return {}
+        now = time.time()
+        conn.executemany('''
+            INSERT INTO products (asin, title, price, list_price, rating, review_count, bestseller, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (asin) DO UPDATE SET
+                title        = COALESCE(excluded.title, title),
+                price        = COALESCE(excluded.price, price),
+                list_price   = COALESCE(excluded.list_price, list_price),
+                rating       = COALESCE(excluded.rating, rating),
+                review_count = COALESCE(excluded.review_count, review_count),
+                bestseller   = COALESCE(excluded.bestseller, bestseller),
+                updated_at   = excluded.updated_at
+        ''', [(product.asin, product.title, product.price, product.list_price, product.rating, product.review_count,
+               product.bestseller, now) for product in products])
+        asins = list({product.asin for product in products})
+        c = conn.execute(f'SELECT asin, id FROM products WHERE asin IN ({", ".join("?" * len(asins))})', asins)
+        return dict(c.fetchall())
+
+    def _next_sequence(self, conn, name, count):
+        """Reserves `count` values of the sequence `name` and returns the first one.
+
+        Unlike rowids, sequence values are never handed out twice, even after the rows holding the highest were deleted.
+        """
+        conn.execute('UPDATE sequences SET value = value + ? WHERE name = ?', (count, name))
+        return conn.execute('SELECT value FROM sequences WHERE name = ?', (name,)).fetchone()[0] - count + 1
+
+    def _save_contexts(self, conn, contexts):
+        """Stores every distinct context once and returns {context: id}."""
+        if not contexts:
+            return {}
+        hashes = {context: hashlib.sha1(context.encode()).hexdigest() for context in contexts}
+        conn.executemany('INSERT OR IGNORE INTO action_contexts (hash, context) VALUES (?, ?)',
+                         [(digest, context) for context, digest in hashes.items()])
+        digests = list(set(hashes.values()))
+        c = conn.execute(f'SELECT hash, id FROM action_contexts WHERE hash IN ({", ".join("?" * len(digests))})',
+                         digests)
+        ids = dict(c.fetchall())
+        return {context: ids[digest] for context, digest in hashes.items()}
+
+    def load_product(self, product_id):
+        """(id, asin, title, price, list_price, rating, review_count, bestseller, updated_at) or None."""
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+                SELECT id, asin, title, price, list_price, rating, review_count, bestseller, updated_at
+                FROM products
+                WHERE id = ?
+            ''', (product_id,))
+            return c.fetchone()
+
+    def load_logs(self, task_id, max_step=None):
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+                SELECT logs.agent_id, logs.task_id, logs.action_id, logs.action_type,
+                       COALESCE(logs.context, action_contexts.context), logs.target_url, logs.step
+                FROM logs
+                LEFT JOIN action_contexts ON action_contexts.id = logs.context_id
+                WHERE logs.task_id = ? AND (? IS NULL OR logs.step <= ?)
+                ORDER BY logs.step
+            ''', (str(task_id), max_step, max_step))
+            return c.fetchall()
+
+    def query_logs(self, after=0, limit=100, agent_id=None, task_id=None, action_type=None, start=None, end=None):
+        """Logged actions with a cursor greater than `after`, oldest first, matching every given filter.
+
+        The cursor of a row is its seq, which is never reused, even for rows
+        re-logged after a resumed task deleted newer ones. Rows are
+        (cursor, timestamp, agent_id, task_id, action_id, action_type, goal, target_url, step).
+        """
+        conditions, params = ['logs.seq > ?'], [after]
+        for condition, value in (('logs.agent_id = ?', agent_id), ('logs.task_id = ?', task_id),
+                                 ('logs.action_type = ?', action_type),
+                                 ('logs.timestamp >= ?', start), ('logs.timestamp < ?', end)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        with self.pool.connection() as conn:
+            c = conn.execute(f'''
+                SELECT logs.seq, logs.timestamp, logs.agent_id, logs.task_id, logs.action_id, logs.action_type,
+                       agent_tasks.initial_goal, logs.target_url, logs.step
+                FROM logs
+                LEFT JOIN agent_tasks ON agent_tasks.id = logs.task_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY logs.seq
+                LIMIT ?
+            ''', params + [limit])
+            return c.fetchall()
+
+    def delete_logs(self, task_id, after_step=0):
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM logs WHERE task_id = ? AND step > ?', (str(task_id), after_step))
+
+    def load_checkpoint(self, task_id):
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+                SELECT step, next_actions, scraper_state FROM task_checkpoints WHERE task_id = ?
+            ''', (str(task_id),))
+            return c.fetchone()
+
+    def delete_checkpoint(self, task_id):
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM task_checkpoints WHERE task_id = ?', (str(task_id),))
+
+    def load_agent(self, agent_id):
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+            SELECT agents.id, agents.name, user_profiles.id, user_profiles.gender, user_profiles.age_from,
+                   user_profiles.age_to, user_profiles.location, user_profiles.interests,
+                   user_profiles.description
+                FROM agents
+                JOIN user_profiles ON agents.user_profile_id = user_profiles.id
+                WHERE agents.id = ?
+            ''', (str(agent_id),))
+            return c.fetchone()
+
+    def list_agents(self, offset=0, limit=1000):
+        """Agents in the order they were created, as rows like load_agent's."""
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+            SELECT agents.id, agents.name, user_profiles.id, user_profiles.gender, user_profiles.age_from,
+                   user_profiles.age_to, user_profiles.location, user_profiles.interests,
+                   user_profiles.description
+                FROM agents
+                JOIN user_profiles ON agents.user_profile_id = user_profiles.id
+                ORDER BY agents.rowid
+                LIMIT ? OFFSET ?
+            ''', (limit, offset))
+            return c.fetchall()
+
+    def save_population(self, population, user_profiles, agents):
+        """Saves a (id, seed, size, spec, created_at) population with its profile and agent rows in one transaction.
+
+        `user_profiles` are rows of the user_profiles table and `agents` are
+        (id, name, user_profile_id, population_id) rows.
+        """
+        with self.pool.transaction() as conn:
+            conn.execute('INSERT INTO populations (id, seed, size, spec, created_at) VALUES (?, ?, ?, ?, ?)', population)
+            conn.executemany('''
+                INSERT INTO user_profiles (id, gender, age_from, age_to, location, interests, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', user_profiles)
+            conn.executemany('''
+                INSERT INTO agents (id, name, user_profile_id, population_id)
+                VALUES (?, ?, ?, ?)
+            ''', agents)
+
+    def load_population(self, population_id):
+        """(id, seed, size, spec, created_at) or None."""
+        with self.pool.connection() as conn:
+            c = conn.execute('SELECT id, seed, size, spec, created_at FROM populations WHERE id = ?',
+                             (str(population_id),))
+            return c.fetchone()
+
+    def list_population_agents(self, population_id):
+        """Agents of a population in the order they were generated, as rows like load_agent's."""
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+            SELECT agents.id, agents.name, user_profiles.id, user_profiles.gender, user_profiles.age_from,
+                   user_profiles.age_to, user_profiles.location, user_profiles.interests,
+                   user_profiles.description
+                FROM agents
+                JOIN user_profiles ON agents.user_profile_id = user_profiles.id
+                WHERE agents.population_id = ?
+                ORDER BY agents.rowid
+            ''', (str(population_id),))
+            return c.fetchall()
+
+    def delete_agent(self, agent_id):
+        """Deletes the agent and its profile; its tasks and logs are kept."""
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                DELETE FROM user_profiles WHERE id = (SELECT user_profile_id FROM agents WHERE id = ?)
+            ''', (str(agent_id),))
+            c = conn.execute('DELETE FROM agents WHERE id = ?', (str(agent_id),))
+            return c.rowcount > 0
+
+    def list_tasks(self, offset=0, limit=1000, agent_id=None):
+        """(id, initial_goal, status) of tasks in the order they were created."""
+        where, params = ('WHERE agent_id = ?', [str(agent_id)]) if agent_id is not None else ('', [])
+        with self.pool.connection() as conn:
+            c = conn.execute(f'''
+            SELECT id, initial_goal, status FROM agent_tasks
+                {where}
+                ORDER BY rowid
+                LIMIT ? OFFSET ?
+            ''', params + [limit, offset])
+            return c.fetchall()
+
+    def load_task(self, task_id):
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+            SELECT agents.id, agents.name, user_profiles.gender, user_profiles.age_from,
+                   user_profiles.age_to, user_profiles.location, user_profiles.interests,
+                   user_profiles.description,
+                   agent_tasks.id, agent_tasks.initial_goal, agent_tasks.status
+                FROM agent_tasks
+                JOIN agents ON agent_tasks.agent_id = agents.id
+                JOIN user_profiles ON agents.user_profile_id = user_profiles.id
+                WHERE agent_tasks.id = ?
+            ''', (str(task_id),))
+            return c.fetchone()
+
+    def load_sessions(self, after=0, limit=500, status=None):
+        """Tasks with a cursor (their rowid) greater than `after`, with their agent and its profile.
+
+        Rows are (cursor, task_id, initial_goal, status, agent_id, agent_name, gender,
+        age_from, age_to, location, interests, description).
+        """
+        where, params = ('AND agent_tasks.status = ?', [status]) if status is not None else ('', [])
+        with self.pool.connection() as conn:
+            c = conn.execute(f'''
+            SELECT agent_tasks.rowid, agent_tasks.id, agent_tasks.initial_goal, agent_tasks.status,
+                   agents.id, agents.name, user_profiles.gender, user_profiles.age_from, user_profiles.age_to,
+                   user_profiles.location, user_profiles.interests, user_profiles.description
+                FROM agent_tasks
+                LEFT JOIN agents ON agent_tasks.agent_id = agents.id
+                LEFT JOIN user_profiles ON agents.user_profile_id = user_profiles.id
+                WHERE agent_tasks.rowid > ? {where}
+                ORDER BY agent_tasks.rowid
+                LIMIT ?
+            ''', [after] + params + [limit])
+            return c.fetchall()
+
+    def load_session_actions(self, task_ids):
+        """Actions of the given tasks with the product they refer to, ordered by task and step.
+
+        Rows are (task_id, step, action_type, context, target_url, timestamp, asin, title,
+        price, list_price, rating, review_count, bestseller); the product columns are NULL
+        for actions without a product.
+        """
+        task_ids = [str(task_id) for task_id in task_ids]
+        with self.pool.connection() as conn:
+            c = conn.execute(f'''
+            SELECT logs.task_id, logs.step, logs.action_type, COALESCE(logs.context, action_contexts.context),
+                   logs.target_url, logs.timestamp,
+                   products.asin, products.title, products.price, products.list_price, products.rating,
+                   products.review_count, products.bestseller
+                FROM logs
+                LEFT JOIN products ON products.id = logs.product_id
+                LEFT JOIN action_contexts ON action_contexts.id = logs.context_id
+                WHERE logs.task_id IN ({', '.join('?' * len(task_ids))})
+                ORDER BY logs.task_id, logs.step
+            ''', task_ids)
+            return c.fetchall()
+
+    def load_recorded_actions(self, agent_id, initial_goal):
+        """Logged actions of every task `agent_id` ran for `initial_goal`, ordered by task and step."""
+        with self.pool.connection() as conn:
+            c = conn.execute('''
+            SELECT logs.task_id, logs.step, logs.action_type, COALESCE(logs.context, action_contexts.context)
+                FROM logs
+                JOIN agent_tasks ON logs.task_id = agent_tasks.id
+                LEFT JOIN action_contexts ON action_contexts.id = logs.context_id
+                WHERE agent_tasks.agent_id = ? AND agent_tasks.initial_goal = ?
+                ORDER BY logs.task_id, logs.step
+            ''', (str(agent_id), initial_goal))
+            return c.fetchall()
+
+    def close(self):
+        self.pool.close()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = Storage(DEFAULT_DB_PATH)
+    return _storage
+
+
+def configure(path, pool_size=8):
+    """Point the process-wide storage at another database file (e.g. for benchmarks)."""
+    global _storage
+    with _storage_lock:
+        if _storage is not None:
+            _storage.close()
+        _storage = Storage(path, pool_size=pool_size)
+    return _storage
@@ -0,0 +1,221 @@
+"""End-to-end throughput of dispatching agents through the API code path.
+
+Creates N agents, dispatches M tasks to each of them through
+main.dispatch_agent and waits until the embedded worker has finished all of
+them. Pages come from a local corpus (FixtureScraper) with simulated latency
+and decisions from a local backend, so no network or API key is needed.
+
+    python -m benchmarks.e2e_bench path/to/html-fixtures --agents 20 --tasks 5 --latency 0.3
+
+--llm-latency makes every decision take that long, to see how much page
+fetching overlaps with it (compare with --no-prefetch).
+
+Tasks take turns through --goals, and the random backend seeds every task
+differently, so repeated tasks browse different paths. Page, extraction and
+decision cache hit rates are printed next to the throughput figures, since a
+run served mostly from caches says little about real traffic.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import threading
+import time
+
+
+class Timings:
+    """Thread-safe collector for durations measured by wrapped functions."""
+
+    def __init__(self):
+        self.lock  = threading.Lock()
+        self.steps = []
+        self.parsed = 0
+        self.page_loads = 0
+        self.fetches = 0
+        self.write_seconds = 0.0
+        self.last_checkpoint = {}
+
+    def wrap_writes(self, cls, names):
+        for name in names:
+            original = getattr(cls, name)
+
+            def timed(*args, _original=original, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    with self.lock:
+                        self.write_seconds += time.perf_counter() - start
+            setattr(cls, name, timed)
+
+    def wrap_parse(self, cls):
+        original = cls.parse_content
+
+        def counted(scraper, page, content):
+            with self.lock:
+                self.parsed += 1
+            return original(scraper, page, content)
+        cls.parse_content = counted
+
+    def wrap_page_loads(self, scraper_cls, fixture_cls):
+        # Every page a task or prefetch asks for, and the ones that missed the page cache
+        for cls, name, counter in ((scraper_cls, "scrape_and_cache_async", "page_loads"),
+                                   (fixture_cls, "fetch_async", "fetches")):
+            original = getattr(cls, name)
+
+            async def counted(*args, _original=original, _counter=counter, **kwargs):
+                with self.lock:
+                    setattr(self, _counter, getattr(self, _counter) + 1)
+                return await _original(*args, **kwargs)
+            setattr(cls, name, counted)
+
+    def wrap_steps(self, cls):
+        # A task checkpoints once when it starts and once after every step
+        original = cls.checkpoint
+
+        def timed(task):
+            now = time.perf_counter()
+            with self.lock:
+                previous = self.last_checkpoint.get(task.id)
+                if previous is not None:
+                    self.steps.append(now - previous)
+                self.last_checkpoint[task.id] = now
+            return original(task)
+        cls.checkpoint = timed
+
+
+DEFAULT_GOALS = ["running shoes", "hiking boots", "trail running socks", "water bottle", "rain jacket",
+                 "yoga mat", "headphones", "coffee grinder", "camping tent", "backpack"]
+
+
+class SlowBackend:
+    """Waits `latency` seconds before every decision, standing in for an LLM round trip."""
+
+    def __init__(self, backend, latency):
+        self.backend = backend
+        self.latency = latency
+
+    def decide(self, task):
+        time.sleep(self.latency)
+        return self.backend.decide(task)
+
+    async def decide_async(self, task):
+        await asyncio.sleep(self.latency)
+        return await self.backend.decide_async(task)
+
+
+def hit_rate(hits, total):
+    return f"{hits / total * 100:5.1f}% of {total}" if total else "    - of 0"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", help="directory, .zip or .tar(.gz) of saved Amazon search and product pages")
+    parser.add_argument("--agents", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=5, help="tasks dispatched per agent")
+    parser.add_argument("--goals", nargs="+", default=DEFAULT_GOALS, help="goals the tasks take turns through")
+    parser.add_argument("--concurrency", type=int, default=100, help="tasks executed at once")
+    parser.add_argument("--latency", type=float, default=0.3, help="median simulated page fetch latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="sigma of the log-normal fetch latency")
+    parser.add_argument("--backend", default="random", help="decision backend, see DecisionBackend.py")
+    parser.add_argument("--llm-latency", type=float, default=0, help="simulated seconds per decision")
+    parser.add_argument("--no-prefetch", action="store_true", help="do not prefetch candidate pages")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    # Everything is configured before main is imported, since main sets up storage and the queue on import
+    workdir = tempfile.mkdtemp(prefix="e2e-bench-")
+    os.environ["EMBEDDED_WORKER"] = "1"
+
+    import Decision
+    import DecisionBackend
+    import Engine
+    import FixtureScraper
+    import PageCache
+    import Prefetcher
+    import Scraper
+    import Storage
+    from AgentTask import AgentTask
+
+    storage = Storage.configure(os.path.join(workdir, "storage.db"))
+    PageCache.configure(os.path.join(workdir, "webpages.db"))
+    Engine.configure(args.concurrency)
+    FixtureScraper.get_corpus(args.fixtures)
+    Scraper.SCRAPER_FIXTURES = args.fixtures
+    FixtureScraper.FIXTURE_LATENCY = args.latency
+    FixtureScraper.FIXTURE_JITTER  = args.jitter
+    DecisionBackend._backend = DecisionBackend.BACKENDS[args.backend]()
+    if args.llm_latency > 0:
+        DecisionBackend._backend = SlowBackend(DecisionBackend._backend, args.llm_latency)
+    if args.no_prefetch:
+        Prefetcher.PREFETCH_CONCURRENCY = 0
+
+    timings = Timings()
+    timings.wrap_writes(Storage.Storage, ["save_logs", "save_tasks", "save_agents", "save_user_profiles",
+                                          "update_task_status", "delete_logs", "delete_checkpoint"])
+    timings.wrap_writes(PageCache.PageCache, ["put"])
+    timings.wrap_parse(Scraper.AmazonScraper)
+    timings.wrap_page_loads(Scraper.Scraper, FixtureScraper.FixtureScraper)
+    timings.wrap_steps(AgentTask)
+
+    import main as api
+
+    api.startup()
+    agent_ids = []
+    for i in range(args.agents):
+        profile = api.UserProfileData(gender="female" if i % 2 else "male", ageFrom=20 + i % 40, ageTo=30 + i % 40,
+                                      location="Seattle, WA", interests=["running", "hiking"])
+        agent_ids.append(api.create_agent(api.AgentCreate(name=f"agent-{i}", profile=profile)).id)
+
+    total = args.agents * args.tasks
+    start = time.perf_counter()
+
+    async def dispatch_all():
+        for i, agent_id in enumerate(agent_ids):
+            for j in range(args.tasks):
+                goal = args.goals[(i + j) % len(args.goals)]
+                await api.dispatch_agent(agent_id, api.AgentTaskMetaData(goal=goal, n=1))
+    asyncio.run(dispatch_all())
+
+    done = 0
+    while time.perf_counter() - start < args.timeout:
+        with storage.pool.connection() as conn:
+            done = conn.execute("SELECT COUNT(*) FROM task_queue WHERE state IN ('done', 'failed')").fetchone()[0]
+        if done >= total:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    api.shutdown()
+    with storage.pool.connection() as conn:
+        failed = conn.execute("SELECT COUNT(*) FROM task_queue WHERE state = 'failed'").fetchone()[0]
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"tasks: {done}/{total} finished ({failed} failed) in {elapsed:.2f} s, "
+          f"{args.agents} agents x {args.tasks} tasks, concurrency {args.concurrency}")
+    print(f"throughput:    {done / elapsed:10.2f} tasks/s")
+    print(f"steps:         {len(timings.steps):10d}  p50 {percentile(timings.steps, 50) * 1000:.1f} ms  "
+          f"p95 {percentile(timings.steps, 95) * 1000:.1f} ms  p99 {percentile(timings.steps, 99) * 1000:.1f} ms")
+    print(f"pages parsed:  {timings.parsed / elapsed:10.2f} pages/s ({timings.parsed} parses)")
+    extraction = Scraper.AmazonScraper.extraction_cache.stats()
+    decisions  = Decision.decision_cache.entries.stats()
+    print(f"page cache:    {hit_rate(timings.page_loads - timings.fetches, timings.page_loads)} page loads")
+    print(f"extraction:    {hit_rate(extraction['hits'], extraction['hits'] + extraction['misses'])} extractions")
+    print(f"decisions:     {hit_rate(decisions['hits'], decisions['hits'] + decisions['misses'])} cached lookups")
+    print(f"sqlite writes: {timings.write_seconds:10.2f} s across all threads")
+    print(f"peak rss:      {peak_rss_mb:10.1f} MB")
+    for prefetcher in Prefetcher._prefetchers.values():
+        print(f"prefetch:      {prefetcher.stats}")
+    print(f"databases in {workdir}")
+
+
+if __name__ == "__main__":
+    main()
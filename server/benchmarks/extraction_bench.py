@@ -0,0 +1,70 @@
+"""Check that the extraction backends agree and measure their throughput.
+
+For every saved page the actions produced by each backend are compared
+(action type, context, target URL and product); any difference is printed and the
+command exits non-zero. Throughput is reported in pages/sec, parse included.
+
+    python -m benchmarks.extraction_bench path/to/html-fixtures --rounds 5
+"""
+import argparse
+import sys
+import time
+
+from Extractors import EXTRACTORS
+from benchmarks.fixtures import InMemoryAmazonScraper, load_fixture_pages
+
+
+def extract(scraper, url):
+    return [(str(action.action_type), action.context, action.target_url, action.product)
+            for action in scraper.extract_actions(scraper.parse_page(url))]
+
+
+def check_parity(scrapers, pages):
+    reference_name, reference = next(iter(scrapers.items()))
+    mismatches = 0
+    for url, _ in pages:
+        expected = extract(reference, url)
+        for name, scraper in scrapers.items():
+            if scraper is reference:
+                continue
+            actual = extract(scraper, url)
+            if actual != expected:
+                mismatches += 1
+                print(f"MISMATCH {name} vs {reference_name}: {url}")
+                for want, got in zip(expected, actual):
+                    if want != got:
+                        print(f"  {reference_name}: {want}\n  {name}: {got}")
+                if len(expected) != len(actual):
+                    print(f"  {reference_name} returned {len(expected)} actions, {name} returned {len(actual)}")
+    return mismatches
+
+
+def throughput(scraper, pages, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for url, _ in pages:
+            extract(scraper, url)
+    return rounds * len(pages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("fixtures", help="directory of saved Amazon search and product .html pages")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pages    = load_fixture_pages(args.fixtures)
+    scrapers = {name: InMemoryAmazonScraper(pages, name) for name in EXTRACTORS}
+
+    mismatches = check_parity(scrapers, pages)
+    print(f"parity: {len(pages) - mismatches}/{len(pages)} pages identical")
+
+    for name, scraper in scrapers.items():
+        print(f"{name:<6} {throughput(scraper, pages, args.rounds):8.1f} pages/sec")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Throughput and failure recovery of the Fetcher against a local stand-in for amazon.com.
+
+Serves saved pages gzip compressed over HTTP/1.1 keep-alive from a local
+server that adds latency and answers a share of requests with 503. Fetches
+every page URL from threads and from coroutines and reports pages/sec,
+requests per connection, retries and failures.
+
+    python -m benchmarks.fetch_bench path/to/html-fixtures --requests 500 --failure-rate 0.1
+"""
+import argparse
+import asyncio
+import gzip
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from Fetcher import Fetcher, FetchError
+from benchmarks.fixtures import load_fixture_pages
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, pages, latency, failure_rate):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.pages        = {urlsplit(url).path + ("?" + urlsplit(url).query if urlsplit(url).query else ""):
+                             gzip.compress(content) for url, content in pages}
+        self.latency      = latency
+        self.failure_rate = failure_rate
+        self.lock         = threading.Lock()
+        self.requests     = 0
+        self.connections  = 0
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        content = self.server.pages.get(self.path)
+        if random.random() < self.server.failure_rate:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch_threads(fetcher, urls, threads):
+    def fetch(url):
+        try:
+            return fetcher.fetch(url) is not None
+        except FetchError:
+            return False
+    with ThreadPoolExecutor(threads) as executor:
+        return sum(executor.map(fetch, urls))
+
+
+def fetch_coroutines(fetcher, urls, concurrency):
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(url):
+            async with semaphore:
+                try:
+                    return await fetcher.fetch_async(url) is not None
+                except FetchError:
+                    return False
+        try:
+            return sum(await asyncio.gather(*(fetch(url) for url in urls)))
+        finally:
+            await fetcher.close_session()
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", help="directory, .zip or .tar(.gz) of saved Amazon search and product pages")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02, help="server side latency per request in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="share of requests answered with 503")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second per host (0: unlimited)")
+    args = parser.parse_args()
+
+    pages = load_fixture_pages(args.fixtures)
+    server = StandInServer(pages, args.latency, args.failure_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    paths = list(server.pages)
+    urls = [server.url(paths[i % len(paths)]) for i in range(args.requests)]
+
+    for name, run in (("threads", fetch_threads), ("asyncio", fetch_coroutines)):
+        fetcher = Fetcher(rate=args.rate, burst=args.concurrency, backoff=0.01, pool_size=args.concurrency)
+        server.requests = server.connections = 0
+        start = time.perf_counter()
+        fetched = run(fetcher, urls, args.concurrency)
+        elapsed = time.perf_counter() - start
+        fetcher.close()
+        print(f"{name:<8} {fetched}/{len(urls)} fetched in {elapsed:6.2f} s  {fetched / elapsed:8.1f} pages/s  "
+              f"{server.requests} requests ({server.requests - len(urls)} retries) over {server.connections} connections")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Helpers for benchmarks that run against a folder of saved Amazon HTML pages."""
+import os
+import tempfile
+
+import PageCache
+from FixtureScraper import load_corpus
+from Scraper import AmazonScraper
+
+
+def load_fixture_pages(path):
+    """Return (url, content) pairs for every .html file in the directory or archive `path`.
+
+    Search result pages are recognised by their markup and get a search URL,
+    everything else is treated as a product details page.
+    """
+    pages = load_corpus(path)
+    if not pages:
+        raise SystemExit(f"No .html fixtures found in {path}")
+    return pages
+
+
+class InMemoryAmazonScraper(AmazonScraper):
+    """AmazonScraper that serves fixture pages from a dict, keeping I/O out of the measurement."""
+
+    def __init__(self, pages, extraction_backend="bs4"):
+        if PageCache._page_cache is None:
+            PageCache.configure(os.path.join(tempfile.mkdtemp(), "webpages.db"))
+        super().__init__(extraction_backend)
+        self.pages = dict(pages)
+        self.search_url = next((url for url in self.pages if url.startswith("https://www.amazon.com/s?k")), None)
+
+    def scrape_and_cache(self, url):
+        return self.pages[url]
@@ -0,0 +1,61 @@
+"""CPU time per page for turning saved Amazon pages into actions.
+
+Compares parsing a product page once per extractor (the previous behaviour)
+with parsing it once into a ParsedPage shared by all extractors, and with
+serving repeated pages from the extraction cache.
+
+    python -m benchmarks.parse_bench path/to/html-fixtures --rounds 5
+"""
+import argparse
+import time
+
+from Scraper import PageType
+from benchmarks.fixtures import InMemoryAmazonScraper, load_fixture_pages
+
+
+def actions_parse_per_extractor(scraper, url):
+    extractor = scraper.extractor
+    if scraper.determine_page_type(url) is PageType.SEARCH_RESULTS:
+        return extractor.extract_products_from_search_page(scraper.parse_page(url))
+    return extractor.extract_recommendations_from_product_details(scraper.parse_page(url)) + \
+        extractor.extract_checkout_from_product_details(scraper.parse_page(url))
+
+
+def actions_parse_once(scraper, url):
+    return scraper.extract_actions(scraper.parse_page(url))
+
+
+def actions_cached(scraper, url):
+    return scraper.scrape_page_into_possible_actions(url)
+
+
+def measure(fn, scraper, pages, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        for url, _ in pages:
+            fn(scraper, url)
+    return (time.process_time() - start) / (rounds * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("fixtures", help="directory of saved Amazon search and product .html pages")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pages   = load_fixture_pages(args.fixtures)
+    scraper = InMemoryAmazonScraper(pages)
+
+    before = measure(actions_parse_per_extractor, scraper, pages, args.rounds)
+    after  = measure(actions_parse_once, scraper, pages, args.rounds)
+    scraper.extraction_cache.clear()
+    cached = measure(actions_cached, scraper, pages, args.rounds)
+    print(f"pages: {len(pages)}  rounds: {args.rounds}")
+    print(f"parse per extractor: {before * 1000:8.2f} ms CPU/page")
+    print(f"parse once:          {after * 1000:8.2f} ms CPU/page  ({before / after:.2f}x)")
+    print(f"extraction cache:    {cached * 1000:8.2f} ms CPU/page  ({before / cached:.2f}x, "
+          f"first round parses)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Prompt tokens per step for the JSON and compact prompt encodings.
+
+Walks a few seeded random browsing sessions over saved Amazon pages and
+renders the decision prompt at every step with each encoding.
+
+    python -m benchmarks.prompt_bench path/to/html-fixtures --sessions 5 --window 3
+"""
+import argparse
+import random
+
+import Decision
+from Action import ActionType
+from FixtureScraper import Corpus
+from PromptEncoding import CompactEncoding, JsonEncoding
+from benchmarks.fixtures import InMemoryAmazonScraper, load_fixture_pages
+
+
+class FixtureWalkScraper(InMemoryAmazonScraper):
+    """Serves URLs that are not in the fixtures with a fixture page of the same type."""
+
+    def __init__(self, pages):
+        super().__init__(pages)
+        self.corpus = Corpus(pages)
+
+    def scrape_and_cache(self, url):
+        return self.corpus.page(url, self.determine_page_type(url))
+
+
+def token_counter(model):
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(model)
+        return lambda text: len(encoding.encode(text)), f"tiktoken ({model})"
+    except Exception as e:
+        # tiktoken downloads its vocabulary on first use
+        print(f"tiktoken unavailable ({type(e).__name__}), estimating 4 characters per token")
+        return lambda text: len(text) // 4, "estimate"
+
+
+def render(encoding, options, history, goal):
+    options_text, previous_actions = encoding.encode(options, history)
+    return Decision.get_prompt_template().format(
+        goal=goal, options=options_text, steps=Decision.MAX_STEPS, prev_steps=Decision.MIN_STEPS,
+        prev_action_count=len(history), previous_actions=previous_actions,
+        gender="female", age_from=25, age_to=34, location="Seattle, WA", interests="running, hiking")
+
+
+def walk(scraper, rng, goal):
+    """Yields (options, history) for every step of one random session."""
+    history = []
+    options = scraper.get_initial_actions(goal)
+    while True:
+        yield options, list(history)
+        choices = options
+        if len(history) < Decision.MAX_STEPS:
+            choices = [a for a in options if a.action_type is not ActionType.BUY_NOW] or options
+        action = rng.choice(choices)
+        history.append(action)
+        if action.action_type is ActionType.BUY_NOW or len(history) > Decision.MAX_STEPS:
+            return
+        options = scraper.scrape_page_into_possible_actions(action.target_url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("fixtures", help="directory of saved Amazon search and product .html pages")
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--window", type=int, default=3, help="history window of the windowed compact encoding")
+    parser.add_argument("--model", default="text-davinci-003")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    count, counter_name = token_counter(args.model)
+    scraper   = FixtureWalkScraper(load_fixture_pages(args.fixtures))
+    encodings = [("json", JsonEncoding()), ("compact", CompactEncoding(history_window=0)),
+                 (f"compact w={args.window}", CompactEncoding(history_window=args.window))]
+
+    totals = {}
+    for session in range(args.sessions):
+        rng = random.Random(args.seed + session)
+        for step, (options, history) in enumerate(walk(scraper, rng, "running shoes"), start=1):
+            for name, encoding in encodings:
+                totals.setdefault(step, {}).setdefault(name, []).append(count(render(encoding, options, history, "running shoes")))
+
+    print(f"sessions: {args.sessions}  tokens: {counter_name}")
+    print("step " + "".join(f"{name:>16}" for name, _ in encodings))
+    overall = {name: 0 for name, _ in encodings}
+    for step in sorted(totals):
+        means = {name: sum(values) / len(values) for name, values in totals[step].items()}
+        print(f"{step:4d} " + "".join(f"{means[name]:16.0f}" for name, _ in encodings))
+        for name in overall:
+            overall[name] += sum(totals[step][name])
+    print("total" + "".join(f"{overall[name]:16d}" for name, _ in encodings))
+    print("ratio" + "".join(f"{overall[name] / overall['json']:16.2f}" for name, _ in encodings))
+
+
+if __name__ == "__main__":
+    main()
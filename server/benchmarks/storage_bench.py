@@ -0,0 +1,119 @@
+"""Compare persisting agents and tasks through Storage against one connection per call.
+
+Run from the server directory:
+
+    python -m benchmarks.storage_bench --n 10000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+import Storage
+from Agent import Agent
+from AgentTask import AgentTask
+from UserProfile import UserProfile
+
+
+def legacy_persist_profile(path, profile):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(Storage.SCHEMA[0])
+    c.execute('''
+        INSERT INTO user_profiles (id, gender, age_from, age_to, location, interests, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        str(profile.id), profile.gender, profile.age_from, profile.age_to, profile.location,
+        ', '.join(profile.interests), profile.description
+    ))
+    conn.commit()
+    conn.close()
+
+
+def legacy_persist_agent(path, agent):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(Storage.SCHEMA[1])
+    c.execute('''
+        INSERT INTO agents (id, name, user_profile_id)
+        VALUES (?, ?, ?)
+    ''', (str(agent.id), agent.name, str(agent.user_profile.id)))
+    conn.commit()
+    conn.close()
+
+
+def legacy_persist_task(path, task):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(Storage.SCHEMA[2])
+    c.execute('''
+        INSERT INTO agent_tasks (id, agent_id, initial_goal, status)
+        VALUES (?, ?, ?, ?)
+    ''', (str(task.id), str(task.agent.id), task.initial_goal, task.status.value))
+    conn.commit()
+    conn.close()
+
+
+def make_fixtures(n):
+    agents, tasks = [], []
+    for i in range(n):
+        profile = UserProfile("female", 20, 40, "New York", ["outdoors", "sports"])
+        agent = Agent(str(uuid.uuid1()), f"Agent {i}", profile)
+        agents.append(agent)
+        tasks.append(AgentTask(agent, None, "Hiking Shoes"))
+    return agents, tasks
+
+
+def bench_legacy(path, agents, tasks):
+    start = time.perf_counter()
+    for agent in agents:
+        legacy_persist_profile(path, agent.user_profile)
+        legacy_persist_agent(path, agent)
+    for task in tasks:
+        legacy_persist_task(path, task)
+    return time.perf_counter() - start
+
+
+def bench_storage_per_row(path, agents, tasks):
+    Storage.configure(path)
+    start = time.perf_counter()
+    for agent in agents:
+        agent.user_profile.persist()
+        agent.persist()
+    for task in tasks:
+        task.persist()
+    return time.perf_counter() - start
+
+
+def bench_storage_batched(path, agents, tasks):
+    storage = Storage.configure(path)
+    start = time.perf_counter()
+    storage.save_user_profiles([agent.user_profile for agent in agents])
+    storage.save_agents(agents)
+    storage.save_tasks(tasks)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=10000, help="number of agents (and tasks) to persist")
+    args = parser.parse_args()
+
+    agents, tasks = make_fixtures(args.n)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [
+            ("per-call connections", bench_legacy(os.path.join(tmp, "legacy.db"), agents, tasks)),
+            ("pooled, one commit per row", bench_storage_per_row(os.path.join(tmp, "pooled.db"), agents, tasks)),
+            ("pooled, batched", bench_storage_batched(os.path.join(tmp, "batched.db"), agents, tasks)),
+        ]
+        Storage.get_storage().close()
+
+    rows = args.n * 3
+    for name, elapsed in results:
+        print(f"{name:<28} {elapsed:8.3f}s  {rows / elapsed:10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 import uuid
-from fastapi import BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-import sqlite3
-import datetime
+import asyncio
+import json
+import os
 
 import Agent
 import AgentTask
-import Action
-import Scraper
+import Dispatch
+import Engine
+import EventBus
+import Export
+import JobQueue
+import LogWriter
+import Population
+import Repository
+import Storage
 import UserProfile
+import worker
 
 app = FastAPI()
 app.add_middleware(
@@ -52,7 +61,8 @@ class AgentResponse(BaseModel):
 
 
 class LogResponse(BaseModel):
-    timestamp: int
+    cursor: int
+    timestamp: Optional[int] = None
     agent_id: str
     task_id: str
     action_id: str
@@ -62,21 +72,18 @@ class LogResponse(BaseModel):
     step: int
 
     @classmethod
-    def from_action_history_entry(cls, action_history_entry: Action.Action,
-                                  task: AgentTask.AgentTask):
-        # TODO: fix the dummy entries
-        step = 0
-        # Will only be set once all actions have been set
-        if action_history_entry.step != None:
-            step = action_history_entry.step
-        return cls(timestamp=int(round(datetime.datetime.now().timestamp())),
-                   agent_id=str(task.agent.id),
-                   task_id=str(task.id),
-                   action_id=str(action_history_entry.action_id),
-                   action_type=str(action_history_entry.action_type),
-                   goal=task.initial_goal,
-                   url=str(action_history_entry.target_url),
-                   step=step)
+    def from_row(cls, row):
+        cursor, timestamp, agent_id, task_id, action_id, action_type, goal, url, step = row
+        # Rows logged before timestamps were stored have none
+        return cls(cursor=cursor,
+                   timestamp=None if timestamp is None else int(round(timestamp)),
+                   agent_id=agent_id,
+                   task_id=task_id,
+                   action_id=action_id,
+                   action_type=action_type,
+                   goal=goal or "",
+                   url=url,
+                   step=step or 0)
 
 class TaskResponse(BaseModel):
     id: str
@@ -84,10 +91,9 @@ class TaskResponse(BaseModel):
     status: str
 
     @classmethod
-    def from_agent_task(cls, agent_task: AgentTask.AgentTask):
-        return cls(id=str(agent_task.id),
-                   goal=agent_task.initial_goal,
-                   status=AgentTask.TaskStatus(agent_task.status).name)
+    def from_row(cls, row):
+        task_id, goal, status = row
+        return cls(id=task_id, goal=goal, status=AgentTask.TaskStatus(status).name)
 
 class AgentCreate(BaseModel):
     name: str
@@ -97,11 +103,74 @@ class AgentTaskMetaData(BaseModel):
     goal: str
     n: int
 
-AGENT_DB: List[Agent.Agent] = {}
-TASK_DB: List[AgentTask.AgentTask] = {}
+class BulkDispatch(BaseModel):
+    agent_ids: List[str] = []
+    agents: List[AgentCreate] = []
+    population_ids: List[str] = []
+    goals: List[str] = Field(..., min_items=1)
+    repetitions: int = Field(1, ge=1)
+
+class DispatchResponse(BaseModel):
+    agent_ids: List[str]
+    tasks: int
+
+class AgeRangeData(BaseModel):
+    ageFrom: int
+    ageTo: int
+    weight: float = 1.0
+
+class PopulationCreate(BaseModel):
+    size: int = Field(..., ge=1, le=Population.MAX_POPULATION_SIZE)
+    seed: Optional[int] = None
+    genders: Optional[Dict[str, float]] = None
+    ageRanges: Optional[List[AgeRangeData]] = None
+    locations: Optional[Dict[str, float]] = None
+    interests: Optional[Dict[str, float]] = None
+    minInterests: int = 2
+    maxInterests: int = 4
+    namePrefix: str = "persona"
+
+class PopulationResponse(BaseModel):
+    id: str
+    size: int
+    seed: int
+
+    @classmethod
+    def from_row(cls, row):
+        population_id, seed, size, spec, created_at = row
+        return cls(id=population_id, size=size, seed=seed)
+
+MAX_PAGE = 10000
+EVENT_HEARTBEAT_SECONDS = 15
+
+# Run queued tasks inside the API process. Set EMBEDDED_WORKER=0 when tasks are executed by `python -m worker`.
+EMBEDDED_WORKER = os.environ.get("EMBEDDED_WORKER", "1") == "1"
+TASK_QUEUE = JobQueue.JobQueue()
+WORKER: Optional[worker.Worker] = None
+
+@app.on_event("startup")
+def startup():
+    global WORKER
+    if EMBEDDED_WORKER:
+        TASK_QUEUE.enqueue_unfinished(AgentTask.TaskStatus.FINISHED.value)
+        WORKER = worker.Worker(Engine.get_engine(), TASK_QUEUE, resolve_task=Repository.get_task_repository().get).start()
+
+@app.on_event("shutdown")
+def shutdown():
+    if WORKER is not None:
+        WORKER.stop()
+    Engine.stop_engine()
+    LogWriter.close_log_writer()
+
 
 @app.post("/agents", response_model=AgentResponse)
 def create_agent(agent_data: AgentCreate):
+    new_agent = agent_from_data(agent_data)
+    Repository.get_agent_repository().add(new_agent)
+    return AgentResponse.from_agent(new_agent)
+
+
+def agent_from_data(agent_data: AgentCreate):
     agent_id      = str(uuid.uuid1())
     profile       = UserProfile.UserProfile(agent_data.profile.gender,
                                              agent_data.profile.ageFrom,
@@ -109,112 +178,205 @@ def create_agent(agent_data: AgentCreate):
                                              agent_data.profile.location,
                                              agent_data.profile.interests,
                                              agent_data.profile.description)
-    new_agent     = Agent.Agent(agent_id, agent_data.name, profile)
-    AGENT_DB[agent_id] = new_agent
-    profile.persist()
-    new_agent.persist()
-    return AgentResponse.from_agent(new_agent)
+    return Agent.Agent(agent_id, agent_data.name, profile)
 
 
 @app.get("/agents", response_model=List[AgentResponse])
-def get_agents():
-    ret = []
-    for agent_entry in AGENT_DB.values():
-        ret.append(AgentResponse.from_agent(agent_entry))
-    return ret
+def get_agents(offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=MAX_PAGE)):
+    return [AgentResponse.from_agent(agent) for agent in Repository.get_agent_repository().list(offset, limit)]
 
 
 @app.get("/agents/{agent_id}", response_model=AgentResponse)
 def get_agent(agent_id: str):
-    if agent_id not in AGENT_DB:
+    agent = Repository.get_agent_repository().get(agent_id)
+    if agent is None:
         raise HTTPException(status_code=404, detail="Agent not found")
-    return AgentResponse.from_agent(AGENT_DB[agent_id])
+    return AgentResponse.from_agent(agent)
 
 
 @app.delete("/agents/{agent_id}", response_model=AgentResponse)
 def delete_agent(agent_id: str):
-    if agent_id not in AGENT_DB:
+    deleted_agent = Repository.get_agent_repository().delete(agent_id)
+    if deleted_agent is None:
         raise HTTPException(status_code=404, detail="Agent not found")
-    deleted_agent = AGENT_DB.pop(agent_id)
-    return deleted_agent
-
+    return AgentResponse.from_agent(deleted_agent)
 
-def run_agent_task(task):
-    task.execute()
 
 @app.post("/agents/{agent_id}/dispatch")
-async def dispatch_agent(agent_id: str, metadata: AgentTaskMetaData, background_tasks: BackgroundTasks):
-    if agent_id not in AGENT_DB:
+async def dispatch_agent(agent_id: str, metadata: AgentTaskMetaData):
+    agent = Repository.get_agent_repository().get(agent_id)
+    if agent is None:
         raise HTTPException(status_code=404, detail="Agent not found")
 
-    agent = AGENT_DB[agent_id]
     # TODO: support different types of scrape source.
-    for _ in range(metadata.n):
-        task = AgentTask.AgentTask(agent, Scraper.AmazonScraper(), metadata.goal)
-        TASK_DB[task.id] = task
-        task.persist()
-        background_tasks.add_task(run_agent_task, task)
+    Dispatch.dispatch([agent], [metadata.goal], metadata.n, TASK_QUEUE)
+    if WORKER is not None:
+        WORKER.notify()
     return "Successfully started"
 
 
+@app.post("/dispatch")
+def dispatch(request: BulkDispatch) -> DispatchResponse:
+    """Runs every goal `repetitions` times with every agent: existing ones (`agent_ids`), those of generated
+    populations (`population_ids`) and ones created with the request (`agents`).
+
+    All tasks are created in one transaction and scheduled goal by goal.
+    """
+    storage = Storage.get_storage()
+    populations = [storage.load_population(population_id) for population_id in request.population_ids]
+    missing = [population_id for population_id, row in zip(request.population_ids, populations) if row is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Populations not found: {', '.join(missing)}")
+
+    agent_count = len(request.agent_ids) + len(request.agents) + sum(row[2] for row in populations)
+    if agent_count == 0:
+        raise HTTPException(status_code=400, detail="No agents to dispatch")
+    task_count = agent_count * len(request.goals) * request.repetitions
+    if task_count > Dispatch.MAX_DISPATCH_TASKS:
+        raise HTTPException(status_code=400,
+                            detail=f"{task_count} tasks requested, at most {Dispatch.MAX_DISPATCH_TASKS} per request")
+
+    agent_repository = Repository.get_agent_repository()
+    agents = [agent_repository.get(agent_id) for agent_id in request.agent_ids]
+    missing = [agent_id for agent_id, agent in zip(request.agent_ids, agents) if agent is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Agents not found: {', '.join(missing)}")
+    for population_id in request.population_ids:
+        agents += agent_repository.population(population_id)
+    new_agents = [agent_from_data(agent_data) for agent_data in request.agents]
+    agents += new_agents
+
+    tasks = Dispatch.dispatch(agents, request.goals, request.repetitions, TASK_QUEUE, new_agents)
+    if WORKER is not None:
+        WORKER.notify()
+    return DispatchResponse(agent_ids=[str(agent.id) for agent in agents], tasks=len(tasks))
+
+
+@app.post("/populations")
+def create_population(request: PopulationCreate) -> PopulationResponse:
+    """Generates `size` agents with profiles drawn from the given distributions; the same seed gives the same personas.
+
+    Omitted distributions use the defaults in Population.py. Dispatch against
+    the population by passing its id in `population_ids` to /dispatch.
+    """
+    try:
+        spec = Population.PopulationSpec(
+            genders=request.genders,
+            age_ranges=None if request.ageRanges is None else
+            [(age_range.ageFrom, age_range.ageTo, age_range.weight) for age_range in request.ageRanges],
+            locations=request.locations,
+            interests=request.interests,
+            min_interests=request.minInterests,
+            max_interests=request.maxInterests,
+            name_prefix=request.namePrefix)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    population_id, seed = Population.create_population(request.size, spec, request.seed)
+    return PopulationResponse(id=population_id, size=request.size, seed=seed)
+
+
+@app.get("/populations/{population_id}")
+def get_population(population_id: str) -> PopulationResponse:
+    row = Storage.get_storage().load_population(population_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Population not found")
+    return PopulationResponse.from_row(row)
+
+
 @app.get("/tasks")
-async def get_tasks() -> List[TaskResponse]:
-    ret = []
-    for task_entry in TASK_DB.values():
-        ret.append(TaskResponse.from_agent_task(task_entry))
-    return ret
+def get_tasks(offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=MAX_PAGE),
+              agent_id: Optional[str] = None) -> List[TaskResponse]:
+    return [TaskResponse.from_row(row) for row in Repository.get_task_repository().list(offset, limit, agent_id)]
 
 
 @app.get("/logs")
-async def get_logs() -> List[LogResponse]:
-    ret = []
-    for task_entry in TASK_DB.values():
-        for action_entry in task_entry.actions_history:
-            ret.append(LogResponse.from_action_history_entry(action_history_entry=action_entry, task=task_entry))
-
-    return ret
-
-def table_exists(table_name):
-    conn = sqlite3.connect('storage.db')
-    c = conn.cursor()
-    c.execute('''
-        SELECT name FROM sqlite_master WHERE type='table' AND name=?
-    ''', (table_name,))
-    return c.fetchone() is not None
-
-def restore_instances():
-    if not (table_exists('agents') and table_exists('user_profiles')):
-        return
-
-    conn = sqlite3.connect('storage.db')
-    c = conn.cursor()
-
-    c.execute('''
-    SELECT agents.id, agents.name, user_profiles.gender, user_profiles.age_from,
-           user_profiles.age_to, user_profiles.location, user_profiles.interests,
-           user_profiles.description,
-           agent_tasks.id, agent_tasks.initial_goal, agent_tasks.status
-        FROM agents
-        JOIN user_profiles ON agents.user_profile_id = user_profiles.id
-        LEFT JOIN agent_tasks ON agent_tasks.agent_id = agents.id
-    ''')
-    rows = c.fetchall()
-    for row in rows:
-        agent_id, agent_name, gender, age_from, age_to, location, interests_str, description, agent_task_id, initial_goal,status = row
-        interests = interests_str.split(', ')
-        user_profile = UserProfile.UserProfile(gender, age_from, age_to, location, interests, description)
-        agent = Agent.Agent(agent_id, agent_name, user_profile)
-
-        if agent_task_id:
-            agenttask = AgentTask.AgentTask(agent, Scraper.AmazonScraper(), initial_goal)
-            agenttask.id = agent_task_id
-            agenttask.status = status
-            agenttask.load_history()
-            if agent_task_id not in TASK_DB:
-                TASK_DB[agent_task_id] = agenttask
-
-        if agent_id not in AGENT_DB:
-            AGENT_DB[agent_id] = agent
-
-# Call the restore_instances function
-restore_instances()
+def get_logs(since: int = 0, limit: int = Query(1000, ge=1, le=MAX_PAGE), agent_id: Optional[str] = None,
+             task_id: Optional[str] = None, action_type: Optional[str] = None,
+             start: Optional[float] = None, end: Optional[float] = None) -> List[LogResponse]:
+    """Logged actions after the `since` cursor, oldest first.
+
+    Pass the cursor of the last row received as `since` to get the next page, or
+    to poll for new rows only. `start` and `end` are unix timestamps.
+    """
+    if action_type is not None and not action_type.startswith("ActionType."):
+        action_type = f"ActionType.{action_type}"
+    rows = Storage.get_storage().query_logs(since, limit, agent_id, task_id, action_type, start, end)
+    return [LogResponse.from_row(row) for row in rows]
+
+def subscribe_events(since, agent_id, task_id, types):
+    event_types = None if types is None else set(types.split(","))
+    return EventBus.get_event_bus().subscribe(since, EventBus.event_filter(agent_id, task_id, event_types))
+
+
+@app.get("/export/sessions")
+def export_sessions(format: str = "ndjson", after: int = Query(0, ge=0), status: Optional[str] = None,
+                    chunk_size: int = Query(Export.DEFAULT_CHUNK_SIZE, ge=1, le=Export.MAX_CHUNK_SIZE)):
+    """Streams browsing sessions as NDJSON, CSV, Parquet or Arrow, see Export.py.
+
+    Every session has a cursor; pass the last one received as `after` to resume.
+    """
+    if format not in Export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, use one of {', '.join(Export.FORMATS)}")
+    if status is not None and status not in AgentTask.TaskStatus.__members__:
+        raise HTTPException(status_code=400, detail="Unknown status")
+    _, media_type, extension, needs_pyarrow = Export.FORMATS[format]
+    if needs_pyarrow and not Export.pyarrow_available():
+        raise HTTPException(status_code=501, detail=f"Exporting {format} needs pyarrow to be installed")
+
+    # A plain generator is iterated in the threadpool, so reading storage.db never blocks the event loop
+    return StreamingResponse(Export.export(format, after, status, chunk_size), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="sessions.{extension}"'})
+
+
+@app.get("/events")
+async def stream_events(request: Request, since: Optional[int] = None, agent_id: Optional[str] = None,
+                        task_id: Optional[str] = None, types: Optional[str] = None,
+                        last_event_id: Optional[str] = Header(None)):
+    """Server-sent events for logged actions ("action") and task status changes ("status").
+
+    Reconnecting clients resume after the cursor of the last event they received,
+    sent as `since` or as the Last-Event-ID header. A client that falls too far
+    behind gets a "lagged" event and is disconnected, and should reconnect. If
+    events after the cursor are no longer retained, the replay starts with a
+    "reset" event and the client should re-sync from /logs.
+    """
+    if since is None and last_event_id:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an event cursor")
+
+    async def stream():
+        with subscribe_events(since, agent_id, task_id, types) as subscription:
+            async for event in subscription.stream(heartbeat=EVENT_HEARTBEAT_SECONDS):
+                if await request.is_disconnected():
+                    break
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"id: {event.cursor}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.websocket("/events/ws")
+async def stream_events_ws(websocket: WebSocket, since: Optional[int] = None, agent_id: Optional[str] = None,
+                           task_id: Optional[str] = None, types: Optional[str] = None):
+    """The events of /events as JSON messages {"cursor", "type", "data"} over a WebSocket."""
+    async def send_events(subscription):
+        async for event in subscription.stream():
+            await websocket.send_json({"cursor": event.cursor, "type": event.type, "data": event.data})
+            if event.type == EventBus.LAGGED:
+                await websocket.close()
+
+    await websocket.accept()
+    with subscribe_events(since, agent_id, task_id, types) as subscription:
+        sender = asyncio.ensure_future(send_events(subscription))
+        try:
+            # Clients only listen; waiting for their disconnect ends the subscription even when no events come
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
@@ -0,0 +1,36 @@
+"""Replaying EventBus history to subscribers that resume after a cursor.
+
+Run from the server directory:
+
+    python -m unittest discover tests
+"""
+import asyncio
+import unittest
+
+import EventBus
+
+
+class ReplayTest(unittest.TestCase):
+    def replay(self, after, history_size=3, published=5):
+        async def run():
+            bus = EventBus.EventBus(history_size=history_size)
+            for i in range(published):
+                bus.publish(EventBus.ACTION, {"i": i})
+            with bus.subscribe(after) as subscription:
+                return [(event.cursor, event.type) for event in subscription._buffer]
+        return asyncio.run(run())
+
+    def test_retained_events_are_replayed(self):
+        self.assertEqual(self.replay(2), [(3, EventBus.ACTION), (4, EventBus.ACTION), (5, EventBus.ACTION)])
+        self.assertEqual(self.replay(5), [])
+
+    def test_gap_starts_with_reset(self):
+        self.assertEqual(self.replay(0), [(2, EventBus.RESET), (3, EventBus.ACTION), (4, EventBus.ACTION),
+                                          (5, EventBus.ACTION)])
+
+    def test_cursor_from_before_restart_starts_with_reset(self):
+        self.assertEqual(self.replay(99)[0], (2, EventBus.RESET))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Both extraction backends must return the same actions for every saved page in tests/fixtures.
+
+Run from the server directory:
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import PageCache
+from Extractors import EXTRACTORS
+from FixtureScraper import load_corpus
+from Scraper import AmazonScraper
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def extract(scraper, url, content):
+    return [(action.action_type, action.context, action.target_url, action.product)
+            for action in scraper.extract_actions(scraper.parse_content(url, content))]
+
+
+class ExtractorParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Scrapers open the process-wide page cache, so keep it out of the working directory
+        cls.workdir = tempfile.mkdtemp()
+        PageCache.configure(os.path.join(cls.workdir, "webpages.db"))
+        cls.pages    = load_corpus(FIXTURES)
+        cls.scrapers = {name: AmazonScraper(name) for name in EXTRACTORS}
+
+    @classmethod
+    def tearDownClass(cls):
+        PageCache.get_page_cache().pool.close()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def test_fixtures_present(self):
+        self.assertGreaterEqual(len(self.pages), 4)
+
+    def test_backends_agree(self):
+        reference_name = next(iter(self.scrapers))
+        for url, content in self.pages:
+            expected = extract(self.scrapers[reference_name], url, content)
+            self.assertTrue(expected, f"{reference_name} found no actions in {url}")
+            for name, scraper in self.scrapers.items():
+                with self.subTest(page=url, backend=name):
+                    self.assertEqual(extract(scraper, url, content), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""LogWriter must not lose rows, or report them committed, when a write fails.
+
+Run from the server directory:
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import Storage
+from LogWriter import LogWriter, LogWriteError
+
+
+class FakeTask:
+    def __init__(self, task_id):
+        self.id    = task_id
+        self.agent = FakeTask.Agent()
+
+    class Agent:
+        id = "agent"
+
+
+class FakeAction:
+    def __init__(self, step):
+        self.action_id   = f"action-{step}"
+        self.action_type = "ActionType.CLICK_SEARCH_RESULT"
+        self.context     = f"context {step}"
+        self.target_url  = f"https://www.amazon.com/dp/B{step}"
+        self.step        = step
+        self.product     = None
+
+
+class LogWriterFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.storage = Storage.configure(os.path.join(self.workdir, "storage.db"))
+        self.failures = 0
+        save_logs = self.storage.save_logs
+
+        def failing_save_logs(rows, checkpoints=()):
+            if self.failures > 0:
+                self.failures -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return save_logs(rows, checkpoints)
+        self.storage.save_logs = failing_save_logs
+        self.writer = LogWriter(max_delay=0.01, retries=2, retry_delay=0.01)
+
+    def tearDown(self):
+        self.writer.close()
+        self.storage.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def logged_steps(self):
+        return [row[6] for row in self.storage.load_logs("task")]
+
+    def test_transient_failure_is_retried(self):
+        self.failures = 2
+        self.writer.submit(FakeTask("task"), FakeAction(1))
+        self.assertTrue(self.writer.flush(timeout=5))
+        self.assertEqual(self.logged_steps(), [1])
+
+    def test_persistent_failure_reaches_flush_and_rows_are_kept(self):
+        self.failures = 1000
+        self.writer.submit(FakeTask("task"), FakeAction(1))
+        with self.assertRaises(LogWriteError):
+            self.writer.flush(timeout=5)
+        self.assertEqual(self.logged_steps(), [])
+
+        # Once writes succeed again the kept rows are committed with the next batch
+        self.failures = 0
+        self.writer.submit(FakeTask("task"), FakeAction(2))
+        self.assertTrue(self.writer.flush(timeout=5))
+        self.assertEqual(self.logged_steps(), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Single-flight fetching of PageCache.get_or_fetch_async when callers are cancelled or fetches fail.
+
+Run from the server directory:
+
+    python -m unittest discover tests
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from PageCache import PageCache
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache   = PageCache(os.path.join(self.workdir, "webpages.db"))
+        self.fetches = 0
+
+    def tearDown(self):
+        self.cache.pool.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def slow_fetch(self, url):
+        self.fetches += 1
+        await asyncio.sleep(0.1)
+        return b"<html>page</html>"
+
+    async def failing_fetch(self, url):
+        self.fetches += 1
+        await asyncio.sleep(0.1)
+        raise ValueError("fetch failed")
+
+    async def start(self, url, fetch, followers):
+        """Starts a leader for `url` and then `followers` callers that join its fetch."""
+        leader = asyncio.ensure_future(self.cache.get_or_fetch_async(url, fetch))
+        await asyncio.sleep(0.02)
+        waiting = [asyncio.ensure_future(self.cache.get_or_fetch_async(url, fetch)) for _ in range(followers)]
+        await asyncio.sleep(0.02)
+        return leader, waiting
+
+    def test_cancelled_leader_lets_followers_retry(self):
+        async def run():
+            leader, followers = await self.start("https://www.amazon.com/dp/B1", self.slow_fetch, 3)
+            leader.cancel()
+            results = await asyncio.gather(*followers, return_exceptions=True)
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [b"<html>page</html>"] * 3)
+        # The first fetch was abandoned; one follower fetched again for the others
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(sum(len(inflight) for inflight in self.cache._inflight), 0)
+
+    def test_cancelled_follower_does_not_cancel_fetch(self):
+        async def run():
+            leader, followers = await self.start("https://www.amazon.com/dp/B2", self.slow_fetch, 3)
+            followers[0].cancel()
+            return await asyncio.gather(leader, *followers[1:])
+
+        self.assertEqual(asyncio.run(run()), [b"<html>page</html>"] * 3)
+        self.assertEqual(self.fetches, 1)
+
+    def test_fetch_error_reaches_followers(self):
+        async def run():
+            leader, followers = await self.start("https://www.amazon.com/dp/B3", self.failing_fetch, 2)
+            return await asyncio.gather(leader, *followers, return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(sum(len(inflight) for inflight in self.cache._inflight), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Cursors of Storage.query_logs.
+
+Run from the server directory:
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from Storage import Storage
+
+
+def log_row(action_id, step):
+    return "agent", "task", action_id, "ActionType.CLICK_SEARCH_RESULT", "context", "url", step, time.time(), None
+
+
+class LogCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.storage = Storage(os.path.join(self.workdir, "storage.db"))
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_cursors_are_not_reused_after_deleting_newest_rows(self):
+        self.storage.save_logs([log_row(f"first-{step}", step) for step in (1, 2, 3)])
+        last_cursor = self.storage.query_logs(0, 10)[-1][0]
+
+        # A resumed task drops the steps after its checkpoint and logs them again
+        self.storage.delete_logs("task", after_step=1)
+        self.storage.save_logs([log_row(f"again-{step}", step) for step in (2, 3)])
+
+        new_rows = self.storage.query_logs(last_cursor, 10)
+        self.assertEqual([row[4] for row in new_rows], ["again-2", "again-3"])
+        self.assertTrue(all(row[0] > last_cursor for row in new_rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
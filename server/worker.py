@@ -0,0 +1,181 @@
+"""Standalone worker that executes queued agent tasks.
+
+    python -m worker --procs 4 --concurrency 100
+
+Each process claims tasks from the durable task_queue in storage.db with a
+lease, keeps the lease alive with heartbeats while the task runs on its
+TaskEngine, and re-queues tasks whose lease expired because their worker died.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+import uuid
+
+import Engine
+import JobQueue
+import LogWriter
+import Repository
+import Storage
+from AgentTask import TaskStatus
+
+logger = logging.getLogger('uvicorn')
+
+
+def load_task(task_id):
+    row = Storage.get_storage().load_task(task_id)
+    if row is None:
+        return None
+    return Repository.task_from_row(row)
+
+
+class Worker:
+    def __init__(self, engine, job_queue=None, concurrency=None, lease_seconds=JobQueue.DEFAULT_LEASE_SECONDS,
+                 poll_interval=1.0, resolve_task=load_task):
+        self.engine        = engine
+        self.job_queue     = job_queue or JobQueue.JobQueue()
+        self.concurrency   = concurrency or engine.max_concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.resolve_task  = resolve_task
+        self.owner         = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running      = {}
+        self._finished     = queue.Queue()
+        self._wake         = threading.Event()
+        self._stopping     = threading.Event()
+        self._thread       = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="task-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Wakes the worker up so newly queued tasks are claimed without waiting for the next poll."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        for future in self._running.values():
+            future.cancel()
+        self.job_queue.release(self.owner)
+
+    def run(self):
+        last_heartbeat = last_requeue = 0.0
+        while not self._stopping.is_set():
+            try:
+                self._collect_finished()
+
+                now = time.monotonic()
+                if self._running and now - last_heartbeat >= self.lease_seconds / 3:
+                    for task_id in self.job_queue.heartbeat(self.owner, list(self._running), self.lease_seconds):
+                        logger.warning(f"Lost lease on task {task_id}, cancelling it")
+                        self._running.pop(task_id).cancel()
+                    last_heartbeat = now
+                if now - last_requeue >= self.lease_seconds:
+                    self.job_queue.requeue_expired()
+                    last_requeue = now
+
+                free = self.concurrency - len(self._running)
+                if free > 0:
+                    for task_id in self.job_queue.claim(self.owner, free, self.lease_seconds):
+                        self._start(task_id)
+            except Exception:
+                logger.exception("Task worker iteration failed")
+
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _start(self, task_id):
+        task = self.resolve_task(task_id)
+        if task is None:
+            self.job_queue.fail(self.owner, task_id, "Task not found")
+            return
+
+        future = self.engine.submit(task)
+        self._running[task_id] = future
+        future.add_done_callback(lambda f: self._on_done(task_id, f))
+
+    def _on_done(self, task_id, future):
+        # Runs on the engine thread; hand the bookkeeping back to the worker thread
+        self._finished.put((task_id, future))
+        self._wake.set()
+
+    def _collect_finished(self):
+        while True:
+            try:
+                task_id, future = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            if self._running.get(task_id) is not future:
+                continue
+            del self._running[task_id]
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                self.job_queue.complete(self.owner, task_id)
+            else:
+                self.job_queue.fail(self.owner, task_id, repr(error))
+
+
+def run_worker_process(concurrency, lease_seconds, poll_interval):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    engine = Engine.TaskEngine(max_concurrency=concurrency)
+    worker = Worker(engine, concurrency=concurrency, lease_seconds=lease_seconds, poll_interval=poll_interval)
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+
+    worker.job_queue.enqueue_unfinished(TaskStatus.FINISHED.value)
+    worker.start()
+    logger.info(f"Worker {worker.owner} started with concurrency {concurrency}")
+    stopped.wait()
+
+    worker.stop()
+    engine.stop()
+    LogWriter.close_log_writer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--concurrency", type=int, default=Engine.DEFAULT_MAX_CONCURRENT_TASKS,
+                        help="tasks executed at once per process")
+    parser.add_argument("--lease", type=float, default=JobQueue.DEFAULT_LEASE_SECONDS,
+                        help="seconds a claimed task stays leased without a heartbeat")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between queue polls")
+    args = parser.parse_args()
+
+    worker_args = (args.concurrency, args.lease, args.poll)
+    if args.procs == 1:
+        run_worker_process(*worker_args)
+        return
+
+    processes = [multiprocessing.Process(target=run_worker_process, args=worker_args, name=f"worker-{i}")
+                 for i in range(args.procs)]
+    for process in processes:
+        process.start()
+
+    def forward(signum, _):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()